@@ -0,0 +1,47 @@
+import hashlib
+import re
+
+from ttl_cache import TTLCache
+
+
+def normalize_question(question):
+    # "When is the midterm?" and "when is the  midterm" share an entry
+    return ' '.join(re.findall(r"[a-z0-9]+", question.lower()))
+
+
+def context_fingerprint(parts):
+    """Hash the exact text sent to the model as context.
+
+    ``parts`` is an iterable of ``(source_id, text)`` pairs. Identical syllabi
+    uploaded by different students produce the same fingerprint, so they share
+    cached answers.
+    """
+    sha = hashlib.sha256()
+    for source_id, text in parts:
+        sha.update(str(source_id).encode('utf-8'))
+        sha.update(b'\0')
+        sha.update(hashlib.sha256(text.encode('utf-8')).digest())
+    return sha.hexdigest()
+
+
+class AnswerCache:
+    def __init__(self, maxsize=1024, ttl=3600):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def _key(self, question, fingerprint, model):
+        return (normalize_question(question), fingerprint, model)
+
+    def get(self, question, fingerprint, model):
+        return self._cache.get(self._key(question, fingerprint, model))
+
+    def put(self, question, fingerprint, model, answer, tags=()):
+        self._cache.set(self._key(question, fingerprint, model), answer, tags=tags)
+
+    def invalidate_syllabus(self, syllabus_id):
+        self._cache.invalidate_tag(f"syllabus:{syllabus_id}")
+
+    def invalidate_user(self, user_id):
+        self._cache.invalidate_tag(f"user:{user_id}")
+
+    def stats(self):
+        return self._cache.stats()
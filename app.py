@@ -1,16 +1,36 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
-from supabase import create_client, Client
+from flask import Flask, render_template, request, redirect, url_for, flash, session, g
 import os
 from dotenv import load_dotenv
 from werkzeug.utils import secure_filename
-from google import genai
-import uuid
 from flask import send_file
 from flask import jsonify
+from flask import Response, stream_with_context
 import io
-from pypdf import PdfReader
-from docx import Document
-import pdfplumber
+import json
+import math
+import mimetypes
+import time
+import hmac
+from contextlib import contextmanager
+from concurrent.futures import wait as wait_for_futures
+from extraction import normalize_text
+from ingest import IngestQueue, row_text, text_fields, STATUS_PENDING, STATUS_READY
+from retrieval import RetrievalIndexes, doc_signature, select_chunks
+from answer_cache import AnswerCache, context_fingerprint
+from supabase_pool import SupabasePool, AuthError
+import data_access
+from metadata_cache import MetadataCache
+from prompt_builder import PromptBuilder, count_tokens
+from metrics import Metrics
+from blob_store import BlobStore, BlobTooLarge
+from citations import citation_index_for
+from term_index import TermIndexes, coverage, extract_terms
+from llm_gateway import LLMGateway, GatewayBusy
+from facts import FACTS_VERSION, extract_facts, row_facts, fact_rows, answer_from_facts, format_date
+from faq import FaqGenerator, faq_is_current, match_faq
+from conversations import ConversationStore, ContextCaches
+from ttl_cache import TTLCache
+from clients import LazyClient, supabase_client, gemini_client
 
 
 load_dotenv(".env.dev")
@@ -21,29 +41,655 @@ app.secret_key = os.getenv("SECRET_KEY", "your-secret-key")
 
 supabase_url = os.getenv("SUPABASE_URL", "https://wwpdbvewqeoindredumk.supabase.co")
 supabase_key = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(supabase_url, supabase_key)
+# The Supabase and Gemini SDKs are imported and their clients built on first use, in each worker
+supabase = LazyClient(lambda: supabase_client(supabase_url, supabase_key))
+
+# Per-request clients for logged-in users, sharing one HTTP connection pool
+# Background jobs write with SUPABASE_SERVICE_ROLE_KEY when set, and never refresh a user's session
+supabase_pool = SupabasePool(supabase_url, supabase_key, jwt_secret=os.getenv("SUPABASE_JWT_SECRET"),
+                             service_key=os.getenv("SUPABASE_SERVICE_ROLE_KEY"))
 
 gemini_api_key = os.getenv("GEMINI_API_KEY")
-client = genai.Client(api_key=gemini_api_key)
+client = LazyClient(lambda: gemini_client(gemini_api_key))
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+
+# Every Gemini call goes through the gateway: identical in-flight prompts share one call, and
+# calls over the concurrency or token budgets get a fast 503 instead of queueing indefinitely
+llm_gateway = LLMGateway(
+    lambda: client.models, GEMINI_MODEL,
+    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", 8)),
+    per_user_concurrency=int(os.getenv("LLM_USER_CONCURRENCY", 2)),
+    tokens_per_minute=int(os.getenv("LLM_TOKENS_PER_MINUTE", 0)) or None,
+    user_tokens_per_minute=int(os.getenv("LLM_USER_TOKENS_PER_MINUTE", 0)) or None,
+    queue_timeout=float(os.getenv("LLM_QUEUE_TIMEOUT", 5))
+)
 
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'pdf', 'docx', 'txt'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
+# Uploads are stored once per distinct file content and removed by `python blob_store.py gc`
+# once no syllabus or document refers to them
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 50 * 1024 * 1024))
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES + 1024 * 1024  # room for the other form fields
+blob_store = BlobStore(UPLOAD_FOLDER, max_bytes=MAX_UPLOAD_BYTES)
+MAX_BULK_FILES = int(os.getenv("MAX_BULK_FILES", 20))
+
+# Files are served with their content hash as ETag. Behind nginx set FILE_OFFLOAD=nginx and map
+# FILE_OFFLOAD_PREFIX to an internal location aliasing uploads/; FILE_OFFLOAD=sendfile sends
+# X-Sendfile for Apache/lighttpd. Otherwise gunicorn streams the file itself.
+FILE_OFFLOAD = os.getenv("FILE_OFFLOAD", "")
+FILE_OFFLOAD_PREFIX = os.getenv("FILE_OFFLOAD_PREFIX", "/protected-uploads")
+FILE_CACHE_MAX_AGE = int(os.getenv("FILE_CACHE_MAX_AGE", 3600))
+app.use_x_sendfile = FILE_OFFLOAD == 'sendfile'
+
+# Uploaded files are parsed once in a background process pool, never on the request path.
+# Extracted text is cached by file content hash so re-uploads skip re-parsing.
+ingest_queue = IngestQueue(
+    os.getenv("EXTRACTION_CACHE_DIR", os.path.join('cache', 'extraction')),
+    max_workers=int(os.getenv("INGEST_WORKERS", 2)),
+    max_memory_bytes=int(os.getenv("EXTRACTION_CACHE_MEMORY_BYTES", 32 * 1024 * 1024)),
+    max_disk_bytes=int(os.getenv("EXTRACTION_CACHE_DISK_BYTES", 512 * 1024 * 1024)),
+    pages_per_job=int(os.getenv("INGEST_PAGES_PER_JOB", 25)),
+    store_workers=int(os.getenv("INGEST_STORE_WORKERS", 2))
+)
+
+# Files not extracted yet are extracted in parallel, waiting at most this long per request
+EXTRACTION_DEADLINE_SECONDS = float(os.getenv("EXTRACTION_DEADLINE_SECONDS", 8))
+
+# /chat only sends the passages most relevant to the question, not every syllabus and document.
+# Indexes are updated one document at a time and snapshotted so a restarted worker reloads them.
+retrieval_indexes = RetrievalIndexes(
+    os.getenv("RETRIEVAL_INDEX_DIR", os.path.join('cache', 'retrieval')),
+    max_users=int(os.getenv("RETRIEVAL_INDEX_USERS", 256))
+)
+DASHBOARD_PAGE_SIZE = int(os.getenv("DASHBOARD_PAGE_SIZE", 25))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", 8))
+RETRIEVAL_TOKEN_BUDGET = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", 6000))
+
+# Context sent to Gemini is capped per prompt and per document
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 24000))
+PROMPT_DOC_TOKEN_CAP = int(os.getenv("PROMPT_DOC_TOKEN_CAP", 12000))
+
+# Chats keep a short, summarized history per conversation. Follow-up turns reuse the context
+# block already assembled for the same documents and, when it is big enough, a Gemini context
+# cache holding it, so they only send the history, any new passages and the question.
+# With REDIS_URL set, conversations are shared by all workers.
+conversations = ConversationStore(
+    max_turns=int(os.getenv("CONVERSATION_TURNS", 4)),
+    turn_tokens=int(os.getenv("CONVERSATION_TURN_TOKENS", 300)),
+    summary_tokens=int(os.getenv("CONVERSATION_SUMMARY_TOKENS", 600)),
+    ttl=int(os.getenv("CONVERSATION_TTL", 3600)),
+    maxsize=int(os.getenv("CONVERSATION_MAX", 1000)),
+    redis_url=os.getenv("REDIS_URL")
+)
+context_blocks = TTLCache(maxsize=int(os.getenv("CONTEXT_BLOCK_CACHE_SIZE", 64)), ttl=int(os.getenv("CONVERSATION_TTL", 3600)))
+context_caches = ContextCaches(
+    lambda: client, GEMINI_MODEL,
+    min_tokens=int(os.getenv("CONTEXT_CACHE_MIN_TOKENS", 4096)),
+    ttl_seconds=int(os.getenv("CONTEXT_CACHE_TTL", 600))
+) if os.getenv("CONTEXT_CACHE", "on") != "off" else None
+
+# Answers to a fixed set of common questions are generated once per syllabus text, in the background
+faq_generator = FaqGenerator(
+    max_workers=int(os.getenv("FAQ_WORKERS", 1)),
+    token_budget=PROMPT_TOKEN_BUDGET,
+    per_doc_cap=PROMPT_DOC_TOKEN_CAP
+)
+
+# Syllabi listings are cached briefly per user and dropped whenever the user changes them
+metadata_cache = MetadataCache(
+    ttl=int(os.getenv("METADATA_CACHE_TTL", 30)),
+    redis_url=os.getenv("REDIS_URL")
+)
+
+# Repeated questions against the same documents are answered without calling Gemini
+answer_cache = AnswerCache(
+    maxsize=int(os.getenv("ANSWER_CACHE_SIZE", 1024)),
+    ttl=int(os.getenv("ANSWER_CACHE_TTL", 3600))
+)
+
+# Question words are looked up in per-syllabus term sets to warn when documents may not cover them
+term_indexes = TermIndexes()
+COVERAGE_THRESHOLD = float(os.getenv("COVERAGE_THRESHOLD", 0.5))
+COVERAGE_WARNING = "This question may not be covered by the available documents. The answer might not be accurate."
+
+# Grading, attendance and date questions are answered from facts extracted at ingest, without Gemini
+UPCOMING_DATES_LIMIT = int(os.getenv("UPCOMING_DATES_LIMIT", 5))
+FACTS_BACKFILL_LIMIT = int(os.getenv("FACTS_BACKFILL_LIMIT", 10))
+
+# Per-stage timings, exposed on /metrics and in Server-Timing headers
+metrics = Metrics()
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+request_seconds = metrics.histogram(
+    'sylliai_request_seconds', 'Time until the response headers are ready', ('endpoint', 'status'))
+stage_seconds = metrics.histogram(
+    'sylliai_stage_seconds', 'Time spent in each stage of a request', ('endpoint', 'stage'))
+prompt_tokens = metrics.histogram(
+    'sylliai_prompt_tokens', 'Context tokens sent to Gemini per prompt', ('endpoint',),
+    buckets=(250, 500, 1000, 2000, 4000, 6000, 8000, 12000, 16000, 24000, 32000))
+
+
+def cache_stats():
+    return {'answer': answer_cache.stats(), 'metadata': metadata_cache.stats(), 'extraction': ingest_queue.cache_stats()}
+
+
+metrics.collector('sylliai_cache_hits_total', 'Cache lookups that found an entry', 'counter', ('cache',),
+                  lambda: {(name,): stats['hits'] for name, stats in cache_stats().items()})
+metrics.collector('sylliai_cache_misses_total', 'Cache lookups that found nothing', 'counter', ('cache',),
+                  lambda: {(name,): stats['misses'] for name, stats in cache_stats().items()})
+metrics.collector('sylliai_llm_requests_total', 'Gemini requests by how the gateway handled them', 'counter', ('outcome',),
+                  lambda: {(outcome,): count for outcome, count in llm_gateway.stats().items() if outcome != 'in_flight'})
+metrics.collector('sylliai_llm_in_flight', 'Gemini calls currently running', 'gauge', (),
+                  lambda: {(): llm_gateway.stats()['in_flight']})
+metrics.collector('sylliai_cache_hit_ratio', 'Share of cache lookups that were hits since start', 'gauge', ('cache',),
+                  lambda: {(name,): stats['hit_ratio'] for name, stats in cache_stats().items()})
+
+
+def context_cache_stats():
+    # Empty while provider-side context caching is turned off
+    return context_caches.stats() if context_caches is not None else {}
+
+
+metrics.collector('sylliai_context_caches_total', 'Gemini context caches by whether a turn created or reused one', 'counter',
+                  ('outcome',), lambda: {(outcome,): count for outcome, count in context_cache_stats().items()
+                                         if outcome != 'entries'})
+metrics.collector('sylliai_context_caches', 'Gemini context caches this worker is tracking', 'gauge', (),
+                  lambda: {(): context_cache_stats()['entries']} if context_caches is not None else {})
     
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def pdf_extractor(file):
-    text = ""
-    with fitz.open(file) as pdf:
-        for page in pdf:
-            text = text + page.get_text()
-    return text
+def endpoint_label():
+    # URLs matching no route (404s, scanners) have no endpoint
+    return request.endpoint or 'unmatched'
+
+
+@contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_seconds.observe(elapsed, endpoint_label(), stage)
+        timings = g.setdefault('stage_timings', {})
+        timings[stage] = timings.get(stage, 0.0) + elapsed
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def add_server_timing(response):
+    if 'request_start' not in g:
+        return response
+    total = time.perf_counter() - g.request_start
+    request_seconds.observe(total, endpoint_label(), str(response.status_code))
+
+    # Streamed answers send headers before Gemini runs, so their llm stage only shows up in /metrics
+    timings = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in g.get('stage_timings', {}).items()]
+    timings.append(f"total;dur={total * 1000:.1f}")
+    response.headers['Server-Timing'] = ', '.join(timings)
+    return response
+
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    if request.endpoint == 'bulk_upload_documents':
+        return jsonify({"error": f"Upload is larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB in total"}), 413
+    flash(f'File is larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB', 'error')
+    return redirect(request.url)
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    if METRICS_TOKEN and not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {METRICS_TOKEN}"):
+        return jsonify({"error": "Unauthorized"}), 401
+    return Response(metrics.render(), content_type=Metrics.CONTENT_TYPE)
+
+
+def get_db():
+    # Database client acting as the logged-in user, or None if the session can't be used
+    if 'db' in g:
+        return g.db
+    if 'access_token' not in session or 'refresh_token' not in session:
+        return None
+
+    try:
+        with timed('auth'):
+            db, refreshed = supabase_pool.client_for(session['access_token'], session['refresh_token'], session.get('user_id'))
+    except AuthError as e:
+        print(f"Session error: {str(e)}")  # For debugging
+        return None
+
+    if refreshed:
+        session['access_token'] = refreshed['access_token']
+        session['refresh_token'] = refreshed['refresh_token']
+    g.db = db
+    return db
+
+
+def cached_syllabi(db, columns=data_access.SYLLABUS_LIST_COLUMNS, limit=None, cursor=None):
+    user_id = session['user_id']
+    with timed('db'):
+        rows, next_cursor = metadata_cache.get_or_load(
+            user_id, f"syllabi:{columns}:{limit}:{cursor}",
+            lambda: list(data_access.list_syllabi(db, user_id, limit=limit, cursor=cursor, columns=columns))
+        )
+    return rows, next_cursor
+
+
+def cached_syllabus(db, syllabus_id, columns=data_access.SYLLABUS_DETAIL_COLUMNS):
+    with timed('db'):
+        return metadata_cache.get_or_load(
+            session['user_id'], f"syllabus:{syllabus_id}:{columns}",
+            lambda: data_access.get_syllabus(db, syllabus_id, columns=columns)
+        )
+
+
+def cached_documents(db, syllabus_id=None):
+    # Documents with their text, for one syllabus or, without an id, all of the user's
+    user_id = session['user_id']
+    if syllabus_id is None:
+        return metadata_cache.get_or_load(user_id, "documents:all",
+                                          lambda: data_access.list_user_documents(db, user_id))
+    return metadata_cache.get_or_load(user_id, f"documents:{syllabus_id}",
+                                      lambda: data_access.list_documents(db, syllabus_id, user_id))
+
+
+def syllabus_terms(db, syllabus):
+    # Terms of a syllabus (loaded with SYLLABUS_TEXT_COLUMNS) and all of its documents
+    rows = [syllabus] + cached_documents(db, syllabus['id'])
+    return term_indexes.get(syllabus['id'], [(row, row_text(row)) for row in rows])
+
+
+def coverage_meta(question, terms):
+    score, missing = coverage(question or '', terms)
+    meta = {"coverage": {"score": round(score, 2), "missing": missing[:10]}}
+    if score < COVERAGE_THRESHOLD:
+        meta["warning"] = COVERAGE_WARNING
+    return meta
+
+
+def index_doc(table, row_id, syllabus_id, course_name, text):
+    # A syllabus or document as the retrieval index sees it
+    kind = 'syllabus' if table == 'syllabi' else 'document'
+    return {'key': f"{kind}:{row_id}", 'syllabus_id': syllabus_id, 'course_name': course_name, 'content': text}
+
+
+def queue_extraction(table, row_id, file_path, course_name=None, syllabus_id=None):
+    # With a course name, the text is added to the user's retrieval index once it is ready
+    access_token = session['access_token']
+    user_id = session['user_id']
+
+    # The job finishes after the request is gone, so it writes through its own client
+    def store(table, row_id, fields):
+        db = supabase_pool.background_client(access_token)
+        if table == 'syllabi' and fields.get('extraction_status') == STATUS_READY:
+            fields = {**fields, 'facts': extract_facts(fields['extracted_text'])}
+        updated = db.table(table).update(fields).eq('id', row_id).execute().data
+        if 'facts' in fields:
+            data_access.replace_facts(db, row_id, fact_rows(row_id, user_id, fields['facts']))
+            if not (updated and faq_is_current(updated[0].get('faq'), fields['extracted_text'])):
+                queue_faq(row_id, course_name, fields['extracted_text'], access_token, user_id)
+        if fields.get('extraction_status') == STATUS_READY and course_name is not None:
+            retrieval_indexes.add(user_id, index_doc(table, row_id, syllabus_id or row_id, course_name,
+                                                     fields['extracted_text']))
+        metadata_cache.invalidate_user(user_id)
+
+    return ingest_queue.submit(table, row_id, file_path, store)
+
+
+def queue_faq(syllabus_id, course_name, text, access_token, user_id):
+    # Background calls go through the gateway without the user's id, so they never take
+    # the user's own chat slots; together they share the slots of one anonymous user
+    def generate(prompt):
+        return llm_gateway.generate(prompt)
+
+    # Other workers may have stale cached rows and queue the same text, so the row is claimed first
+    def claim(key):
+        db = supabase_pool.background_client(access_token)
+        return data_access.claim_faq(db, syllabus_id, key, faq_generator.retry_seconds)
+
+    def store(faq):
+        db = supabase_pool.background_client(access_token)
+        data_access.store_faq(db, syllabus_id, faq)
+        metadata_cache.invalidate_user(user_id)
+
+    return faq_generator.submit(syllabus_id, course_name, text, generate, store, claim)
+
+
+def backfill_facts(db):
+    # Syllabi ingested before facts existed, or by an older extractor, get them the first time the user's dates are shown
+    user_id = session['user_id']
+    pending = metadata_cache.get_or_load(user_id, "facts:pending",
+                                         lambda: data_access.list_syllabi_without_facts(db, user_id, FACTS_VERSION))
+    if not pending:
+        return
+    with timed('facts'):
+        for row in pending[:FACTS_BACKFILL_LIMIT]:
+            syllabus = data_access.get_syllabus(db, row['id'], columns=data_access.SYLLABUS_TEXT_COLUMNS)
+            text = row_text(syllabus) if syllabus else None
+            if text is None:
+                continue
+            facts = extract_facts(text)
+            db.table('syllabi').update({'facts': facts}).eq('id', row['id']).execute()
+            data_access.replace_facts(db, row['id'], fact_rows(row['id'], user_id, facts))
+    metadata_cache.invalidate_user(user_id)
+
+
+def upcoming_dates(db, limit=UPCOMING_DATES_LIMIT):
+    user_id = session['user_id']
+    today = time.strftime('%Y-%m-%d')
+    with timed('db'):
+        rows = metadata_cache.get_or_load(user_id, f"facts:dates:{today}:{limit}",
+                                          lambda: data_access.list_fact_dates(db, user_id, since=today, limit=limit))
+    return rows
+
+
+def facts_answer(question, syllabi):
+    # (text, meta) answering from the facts of the given syllabi (loaded with SYLLABUS_TEXT_COLUMNS), or None
+    with timed('facts'):
+        courses = []
+        for syllabus in syllabi:
+            text = row_text(syllabus)
+            if text is not None:
+                courses.append((syllabus['id'], syllabus.get('course_name', 'Untitled Course'), row_facts(syllabus, text)))
+        found = answer_from_facts(question, courses)
+    if found is None:
+        return None
+    text, syllabus_ids = found
+    names = {syllabus['id']: syllabus.get('course_name', 'Untitled Course') for syllabus in syllabi}
+    meta = {
+        "facts": True,
+        "cached": False,
+        "sources": [{"course_name": names[syllabus_id], "syllabus_id": syllabus_id} for syllabus_id in syllabus_ids]
+    }
+    return text, meta
+
+
+def load_context_docs(syllabi, documents=(), deadline=EXTRACTION_DEADLINE_SECONDS):
+    # Returns (docs, skipped) for the syllabi and the documents attached to them. Rows
+    # without extracted text yet are fanned out to the ingest pool together; any that
+    # miss the deadline are skipped for this request and keep extracting in the background.
+    course_names = {syllabus['id']: syllabus.get('course_name', 'Untitled Course') for syllabus in syllabi}
+    rows = [('syllabi', syllabus, syllabus['id']) for syllabus in syllabi]
+    rows += [('documents', document, document['syllabus_id'])
+             for document in documents if document['syllabus_id'] in course_names]
+
+    texts = {}
+    waiting = []
+    failed = set()
+    for table, row, syllabus_id in rows:
+        content = row_text(row)
+        if content:
+            texts[(table, row['id'])] = content
+        elif row.get('extraction_status') in (None, STATUS_PENDING) and row.get('file_path'):
+            # Also backfills rows uploaded before ingest existed and jobs lost to a restart
+            future = queue_extraction(table, row['id'], row['file_path'], course_names[syllabus_id], syllabus_id)
+            waiting.append((future, (table, row['id'])))
+        else:
+            failed.add((table, row['id']))
+
+    if waiting:
+        with timed('extract'):
+            done, _ = wait_for_futures([future for future, _ in waiting], timeout=deadline)
+        for future, key in waiting:
+            if future in done and future.exception() is None:
+                texts[key] = future.result()
+            elif future in done:
+                failed.add(key)
+
+    docs = []
+    skipped = []
+    for table, row, syllabus_id in rows:
+        key = (table, row['id'])
+        course_name = course_names[syllabus_id]
+        is_syllabus = table == 'syllabi'
+        name = course_name if is_syllabus else row.get('name') or 'Untitled Document'
+        if key in texts:
+            text = texts[key]
+            docs.append({
+                **index_doc(table, row['id'], syllabus_id, course_name, text),
+                'id': row['id'],
+                'document_id': None if is_syllabus else row['id'],
+                'name': name,
+                'type': 'syllabus' if is_syllabus else row.get('document_type') or 'document',
+                'row': row,
+                'citations': citation_index_for(row, text)
+            })
+        else:
+            skipped.append({
+                "course_name": course_name,
+                "syllabus_id": syllabus_id,
+                "skipped": True,
+                "reason": "failed" if key in failed else "processing"
+            })
+            if not is_syllabus:
+                skipped[-1].update(document_id=row['id'], document_name=name)
+    return docs, skipped
+
+
+def passage_item(doc, chunk):
+    # A retrieved chunk as a context item; its text is read back from the document each turn
+    cite = doc['citations'].cite(chunk['start'], chunk['end'])
+    return {
+        'key': f"{chunk['doc_id']}:{chunk['start']}:{chunk['end']}",
+        'digest': doc_signature(chunk['text']),
+        'tokens': count_tokens(chunk['text']),
+        'doc_id': chunk['doc_id'], 'syllabus_id': doc['syllabus_id'], 'document_id': doc['document_id'],
+        'doc_type': doc['type'], 'doc_name': doc['name'], 'course_name': doc['course_name'], 'page': chunk['page'],
+        'line': cite['line'], 'end_line': cite['end_line'], 'start': chunk['start'], 'end': chunk['end']
+    }
+
+
+def build_passages(items, text_for, budget):
+    # (built, included items) for context items, each under a header saying where it comes from
+    builder = PromptBuilder(budget, per_doc_cap=PROMPT_DOC_TOKEN_CAP)
+    for i, item in enumerate(items):
+        header = f"Document Type: {item['doc_type']}\nCourse: {item['course_name']}\n"
+        if item['document_id'] is not None:
+            header += f"Document: {item['doc_name']}\n"
+        header += f"Page: {item['page']}, lines {item['line']}-{item['end_line']}\nContent:\n"
+        builder.add(item['doc_id'], header, text_for(item), key=i)
+    built = builder.build()
+    return built, [items[i] for i in built['included']]
+
+
+def passage_source(item):
+    source = {
+        "course_name": item['course_name'],
+        "syllabus_id": item['syllabus_id'],
+        "page": item['page'],
+        "line": item['line'],
+        "end_line": item['end_line'],
+        "start": item['start'],
+        "end": item['end']
+    }
+    if item['document_id'] is not None:
+        source.update(document_id=item['document_id'], document_name=item['doc_name'])
+    return source
+
+
+def serve_upload(file_path):
+    etag = blob_store.content_hash(file_path)
+    if FILE_OFFLOAD == 'nginx':
+        # nginx sends the bytes and handles Range; only validators and the internal path come from here
+        relative_path = os.path.relpath(file_path, UPLOAD_FOLDER).replace(os.sep, '/')
+        response = Response(mimetype=mimetypes.guess_type(file_path)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = f"{FILE_OFFLOAD_PREFIX}/{relative_path}"
+        response.set_etag(etag)
+        response.make_conditional(request)
+    else:
+        # conditional=True answers If-None-Match with 304 and Range with 206
+        response = send_file(file_path, etag=etag, conditional=True, max_age=FILE_CACHE_MAX_AGE)
+
+    # Per-user content, so browsers may cache it but shared caches may not
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.max_age = FILE_CACHE_MAX_AGE
+    return response
+
+
+def wants_stream():
+    return 'text/event-stream' in request.headers.get('Accept', '')
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_response(events):
+    return Response(stream_with_context(events), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # Stop nginx from buffering the stream
+        'X-Accel-Buffering': 'no'
+    })
+
+
+def busy_response(e):
+    response = jsonify({"error": "SylliAI is busy right now. Please try again in a few seconds.", "busy": True})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(max(1, math.ceil(e.retry_after)))
+    return response
+
+
+def stream_answer(chunks, meta, on_complete=None, on_error=None):
+    # Forward tokens as Gemini produces them so the first words show up right away
+    def events():
+        yield sse_event('meta', meta)
+        parts = []
+        try:
+            with timed('llm'):
+                for text in chunks:
+                    parts.append(text)
+                    yield sse_event('token', {"text": text})
+        except GatewayBusy:
+            yield sse_event('error', {"error": "SylliAI is busy right now. Please try again in a few seconds.", "busy": True})
+            return
+        except Exception as e:
+            print(f"Gemini API error: {str(e)}")  # For debugging
+            if on_error:
+                on_error()
+            yield sse_event('error', {"error": f"Error generating response: {str(e)}"})
+            return
+        finally:
+            chunks.close()
+        if on_complete:
+            on_complete(''.join(parts))
+        yield sse_event('done', {})
+
+    return sse_response(events())
+
+
+def text_response(text, meta):
+    # An answer that is already complete, sent the same way a Gemini answer would be
+    if wants_stream():
+        return sse_response(iter([
+            sse_event('meta', meta),
+            sse_event('token', {"text": text}),
+            sse_event('done', {})
+        ]))
+    return jsonify({"response": text, **meta})
+
+
+def conversation_meta(conversation):
+    # history_dropped tells the client its earlier turns were not found, so this answer starts afresh
+    meta = {"conversation_id": conversation.id}
+    if conversation.history_dropped:
+        meta["history_dropped"] = True
+    return meta
+
+
+def conversation_reply(conversation, question, text, meta):
+    # Answers that need no Gemini call still become part of the conversation
+    conversations.add_turn(conversation, question, text)
+    return text_response(text, {**meta, **conversation_meta(conversation)})
+
+
+def conversation_prompt(conversation, cache_key, system, base_text, base_tokens, extra_text, extra_tokens, question_text):
+    """Build this turn's prompt from the conversation's context and history.
+
+    Follow-up turns whose base block is in a provider-side context cache send
+    only the new passages, the history and the question. Everything else
+    sends the whole prompt, which is also kept as the fallback should the
+    cache be gone.
+    """
+    history = conversation.history_text()
+    tail = '\n\n'.join(part for part in (extra_text, history, question_text) if part)
+    inline = f"{system}\n\n{base_text}\n\n{tail}"
+    turn = {
+        'prompt': inline, 'inline_prompt': inline, 'cached_content': None, 'cache_key': cache_key,
+        'fingerprint': context_fingerprint([('context', base_text), ('extra', extra_text), ('history', history)]),
+        'tokens': {"used": base_tokens + extra_tokens, "cached": 0, "history": count_tokens(history)}
+    }
+    if conversation.is_follow_up and context_caches is not None:
+        with timed('cache'):
+            name = context_caches.get(cache_key, system, base_text, base_tokens)
+        if name:
+            turn['prompt'] = tail
+            turn['cached_content'] = name
+            turn['tokens'] = {**turn['tokens'], "used": extra_tokens, "cached": base_tokens}
+    return turn
+
+
+def answer(turn, meta, question, tags, conversation):
+    fingerprint = turn['fingerprint']
+    meta = {**meta, **conversation_meta(conversation)}
+    cached = answer_cache.get(question, fingerprint, GEMINI_MODEL)
+    if cached is not None:
+        conversations.add_turn(conversation, question, cached)
+        return text_response(cached, {**meta, "cached": True})
+
+    meta = {**meta, "cached": False}
+
+    def store(text):
+        answer_cache.put(question, fingerprint, GEMINI_MODEL, text, tags=tags)
+        conversations.add_turn(conversation, question, text)
+
+    def forget_cache():
+        # A context cache that fails (expired early, deleted) is dropped so the next turn makes a new one
+        if turn['cached_content']:
+            context_caches.forget(turn['cache_key'])
+
+    tokens = meta['tokens']['used'] + meta['tokens']['history'] + count_tokens(question or '')
+    if wants_stream():
+        try:
+            chunks = llm_gateway.stream(turn['prompt'], user_id=session.get('user_id'), tokens=tokens,
+                                        cached_content=turn['cached_content'])
+        except GatewayBusy as e:
+            return busy_response(e)
+        except Exception as e:
+            print(f"Gemini API error: {str(e)}")  # For debugging
+            return jsonify({"error": f"Error generating response: {str(e)}"}), 500
+        return stream_answer(chunks, meta, on_complete=store, on_error=forget_cache)
+
+    try:
+        with timed('llm'):
+            try:
+                text = llm_gateway.generate(turn['prompt'], user_id=session.get('user_id'), tokens=tokens,
+                                            cached_content=turn['cached_content'])
+            except GatewayBusy:
+                raise
+            except Exception as e:
+                if not turn['cached_content']:
+                    raise
+                print(f"Context cache error, sending the full prompt: {str(e)}")  # For debugging
+                forget_cache()
+                text = llm_gateway.generate(turn['inline_prompt'], user_id=session.get('user_id'), tokens=tokens)
+    except GatewayBusy as e:
+        return busy_response(e)
+    except Exception as e:
+        print(f"Gemini API error: {str(e)}")  # For debugging
+        return jsonify({"error": f"Error generating response: {str(e)}"}), 500
+
+    store(text)
+    return jsonify({"response": text, **meta})
 
 
 @app.route('/')
@@ -100,9 +746,6 @@ def login():
             session['refresh_token'] = response.session.refresh_token
             
             
-            user_data = supabase.table('users').select('*').eq('id', response.user.id).execute()
-            
-            
             flash('Logged in successfully!', 'success')
             return redirect(url_for('dashboard'))
         except Exception as e:
@@ -113,6 +756,8 @@ def login():
 @app.route('/logout')
 def logout():
     
+    if 'user_id' in session:
+        conversations.invalidate_user(session['user_id'])
     session.clear()
     flash('Logged out successfully!', 'success')
     return redirect(url_for('index'))
@@ -125,20 +770,67 @@ def dashboard():
     
     
     try:
-        # Check if both tokens exist in session before using them
-        if 'access_token' in session and 'refresh_token' in session:
-            supabase.auth.set_session(session['access_token'], session['refresh_token'])
-        else:
+        db = get_db()
+        if db is None:
             flash('Session expired. Please log in again.', 'error')
             return redirect(url_for('login'))
         
-        response = supabase.table('syllabi').select('*').eq('user_id', session['user_id']).execute()
-        syllabi = response.data
+        syllabi, next_cursor = cached_syllabi(db, limit=DASHBOARD_PAGE_SIZE, cursor=request.args.get('cursor'))
     except Exception as e:
         flash(f'Error retrieving syllabi: {str(e)}', 'error')
         syllabi = []
+        next_cursor = None
+    
+    # Upcoming exams and deadlines come from the facts table, so they cost one small query
+    upcoming = []
+    if syllabi:
+        try:
+            backfill_facts(db)
+            upcoming = upcoming_dates(db)
+        except Exception as e:
+            print(f"Error retrieving upcoming dates: {str(e)}")  # For debugging
     
-    return render_template('dashboard.html', syllabi=syllabi)
+    names = {syllabus['id']: syllabus['course_name'] for syllabus in syllabi}
+    if any(row['syllabus_id'] not in names for row in upcoming):
+        # Deadlines of syllabi on later pages
+        names.update((syllabus['id'], syllabus['course_name']) for syllabus in cached_syllabi(db)[0])
+    return render_template('dashboard.html', syllabi=syllabi, next_cursor=next_cursor,
+                           is_first_page=not request.args.get('cursor'), upcoming=upcoming,
+                           course_names=names, format_date=format_date)
+
+
+@app.route('/calendar')
+def calendar():
+    if 'user_id' not in session:
+        flash('Please log in to view your calendar', 'error')
+        return redirect(url_for('login'))
+    
+    try:
+        db = get_db()
+        if db is None:
+            flash('Session expired. Please log in again.', 'error')
+            return redirect(url_for('login'))
+        
+        backfill_facts(db)
+        syllabi, _ = cached_syllabi(db)
+        with timed('db'):
+            dates = metadata_cache.get_or_load(session['user_id'], "facts:dates",
+                                               lambda: data_access.list_fact_dates(db, session['user_id']))
+    except Exception as e:
+        flash(f'Error retrieving calendar: {str(e)}', 'error')
+        return redirect(url_for('dashboard'))
+    
+    # Grouped by month; dates the syllabus gave without a year go last
+    months = []
+    for row in dates:
+        month = time.strftime('%B %Y', time.strptime(row['due_date'], '%Y-%m-%d')) if row.get('due_date') else 'Date not specified'
+        if not months or months[-1][0] != month:
+            months.append((month, []))
+        months[-1][1].append(row)
+    
+    names = {syllabus['id']: syllabus['course_name'] for syllabus in syllabi}
+    return render_template('calendar.html', months=months, course_names=names,
+                           today=time.strftime('%Y-%m-%d'), format_date=format_date)
 
 @app.route('/upload', methods=['GET', 'POST'])
 def upload_syllabus():
@@ -163,25 +855,36 @@ def upload_syllabus():
             
             if file and allowed_file(file.filename):
                 filename = secure_filename(file.filename)
-                unique_filename = f"{uuid.uuid4()}_{filename}"
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-                file.save(file_path)
+                fileExtension = filename.rsplit('.', 1)[1].lower()
+                db = get_db()
+                if db is None:
+                    flash('Session expired. Please log in again.', 'error')
+                    return redirect(url_for('login'))
                 
+                try:
+                    with timed('save'):
+                        file_path, _, _ = blob_store.put(file.stream, fileExtension)
+                except BlobTooLarge as e:
+                    flash(str(e), 'error')
+                    return redirect(request.url)
                 
                 try:
-                    # Check if both tokens exist in session before using them
-                    if 'access_token' in session and 'refresh_token' in session:
-                        supabase.auth.set_session(session['access_token'], session['refresh_token'])
-                    else:
-                        flash('Session expired. Please log in again.', 'error')
-                        return redirect(url_for('login'))
-                    fileExtension = filename.rsplit('.', 1)[1].lower()
-                    supabase.table('syllabi').insert({
-                        "user_id": session['user_id'],
-                        "course_name": course_name,
-                        "file_path": file_path,
-                        "content_type": f"{fileExtension.upper()} File"
-                    }).execute()
+                    with timed('db'):
+                        try:
+                            insert_response = db.table('syllabi').insert({
+                                "user_id": session['user_id'],
+                                "course_name": course_name,
+                                "file_path": file_path,
+                                "content_type": f"{fileExtension.upper()} File",
+                                "extraction_status": STATUS_PENDING
+                            }).execute()
+                        except Exception:
+                            blob_store.release(file_path)
+                            raise
+                    with timed('queue'):
+                        queue_extraction('syllabi', insert_response.data[0]['id'], file_path, course_name)
+                    answer_cache.invalidate_user(session['user_id'])
+                    metadata_cache.invalidate_user(session['user_id'])
                 except Exception as e:
                     flash(f'Error uploading syllabus: {str(e)}', 'error')
                     return redirect(url_for('upload_syllabus'))
@@ -194,19 +897,32 @@ def upload_syllabus():
             
             
             try:
-                # Check if both tokens exist in session before using them
-                if 'access_token' in session and 'refresh_token' in session:
-                    supabase.auth.set_session(session['access_token'], session['refresh_token'])
-                else:
+                db = get_db()
+                if db is None:
                     flash('Session expired. Please log in again.', 'error')
                     return redirect(url_for('login'))
                 
-                supabase.table('syllabi').insert({
-                    "user_id": session['user_id'],
-                    "course_name": course_name,
-                    "content": content,
-                    "content_type": "text"
-                }).execute()
+                with timed('normalize'):
+                    fields = text_fields(normalize_text(content or ''))
+                    fields['facts'] = extract_facts(fields['extracted_text'])
+                with timed('db'):
+                    insert_response = db.table('syllabi').insert({
+                        "user_id": session['user_id'],
+                        "course_name": course_name,
+                        "content": content,
+                        "content_type": "text",
+                        **fields
+                    }).execute()
+                    syllabus_id = insert_response.data[0]['id']
+                    data_access.insert_facts(db, fact_rows(syllabus_id, session['user_id'], fields['facts']))
+                with timed('queue'):
+                    queue_faq(syllabus_id, course_name, fields['extracted_text'],
+                              session['access_token'], session['user_id'])
+                with timed('retrieval'):
+                    retrieval_indexes.add(session['user_id'], index_doc('syllabi', syllabus_id, syllabus_id, course_name,
+                                                                        fields['extracted_text']))
+                answer_cache.invalidate_user(session['user_id'])
+                metadata_cache.invalidate_user(session['user_id'])
             except Exception as e:
                 flash(f'Error saving syllabus content: {str(e)}', 'error')
                 return redirect(url_for('upload_syllabus'))
@@ -222,14 +938,12 @@ def settings():
         flash('Please log in to access settings', 'error')
         return redirect(url_for('login'))
     try:
-        # Check if both tokens exist in session before using them
-        if 'access_token' in session and 'refresh_token' in session:
-            supabase.auth.set_session(session['access_token'], session['refresh_token'])
-        else:
+        db = get_db()
+        if db is None:
             flash('Session expired. Please log in again.', 'error')
             return redirect(url_for('login'))
         
-        user_data = supabase.table('users').select('*').eq('id', session['user_id']).execute()
+        user_data = db.table('users').select('*').eq('id', session['user_id']).execute()
         user = user_data.data[0] if user_data.data else None
     except Exception as e:
         flash(f'Error retrieving user data: {str(e)}', 'error')
@@ -242,31 +956,6 @@ def settings():
     
     return render_template('settings.html', user=user)
 
-def extract_text_from_file(file_path):
-    try:    
-        if file_path.lower().endswith('.pdf'):
-            with pdfplumber.open(file_path) as pdf:
-                text = ''
-                for page_number, page in enumerate(pdf.pages):
-                    text += page.extract_text() or ''
-            return text.strip()   
-         
-        elif file_path.lower().endswith('.docx'):
-            doc = Document(file_path)
-            text = '\n'.join([para.text for para in doc.paragraphs])
-            return text.strip()    
-        
-        elif file_path.lower().endswith('.txt'):
-            with open(file_path, 'r') as file:
-                text = file.read().strip()
-            return text
-        
-        else:
-            return "Unsupported file type"
-    except Exception as e:
-        print(f"Error reading file {file_path}: {str(e)}")
-        return None
-
 @app.route('/chat', methods=['GET', 'POST'])
 def chat():
     if 'user_id' not in session:
@@ -274,67 +963,89 @@ def chat():
         return redirect(url_for('login'))
     
     try:
-        if 'access_token' in session and 'refresh_token' in session:
-            supabase.auth.set_session(session['access_token'], session['refresh_token'])
-        else:
+        db = get_db()
+        if db is None:
             flash('Session expired. Please log in again.', 'error')
             return redirect(url_for('login'))
         
         if request.method == 'POST':
             data = request.get_json()
             user_message = data.get('message')
+            conversation = conversations.get_or_create(session['user_id'], 'all', data.get('conversation_id'))
             
             # Retrieve all syllabi and documents for the user
-            syllabi_response = supabase.table('syllabi').select('*').eq('user_id', session['user_id']).execute()
+            syllabi, _ = cached_syllabi(db, columns=data_access.SYLLABUS_TEXT_COLUMNS)
             
-            # Extract content and metadata from syllabi and documents
-            context_docs = []
-            for syllabus in syllabi_response.data:
-                syllabus_content = {
-                    'course_name': syllabus.get('course_name', 'Untitled Course'),
-                    'content': syllabus.get('content', ''),
-                    'type': 'syllabus'
-                }
-                
-                # If it's a file-based syllabus, try to extract content
-                if syllabus.get('content_type', '').lower().endswith('file') and syllabus.get('file_path'):
-                    extraced_text = extract_text_from_file(syllabus['file_path'])
-                    if extraced_text:
-                        syllabus_content['content'] = extraced_text
-                        
-                if syllabus_content['content']:
-                    context_docs.append(syllabus_content)
+            # Grading, attendance and date questions are answered from the extracted facts
+            found = facts_answer(user_message, syllabi)
+            if found is not None:
+                return conversation_reply(conversation, user_message, *found)
             
-            # Create enhanced prompt for Gemini
-            prompt = """You are SylliAI, an AI assistant specialized in analyzing course syllabi and related documents.
+            # Use the text extracted at upload time; files still being extracted get a short deadline
+            with timed('db'):
+                documents = cached_documents(db)
+            context_docs, skipped = load_context_docs(syllabi, documents)
+            
+            with timed('retrieval'):
+                index = retrieval_indexes.get(session['user_id'], context_docs)
+                chunks = select_chunks(index, user_message, top_k=RETRIEVAL_TOP_K, token_budget=RETRIEVAL_TOKEN_BUDGET)
+            
+            system = """You are SylliAI, an AI assistant specialized in analyzing course syllabi and related documents.
             Analyze the following content and provide detailed, accurate answers based on the available information.
             If information is not found in the documents, clearly state that.
+            Cite the course, page and lines each fact comes from, e.g. (Course, p. 2, lines 4-9).
             
             Available Documents:
             """
             
-            # Add context with document structure
-            for doc in context_docs:
-                prompt += f"\n\nDocument Type: {doc['type']}\nCourse: {doc['course_name']}\nContent:\n{doc['content']}"
+            # Passages are kept by position in their document; the text is read back from it each turn
+            docs_by_key = {doc['key']: doc for doc in context_docs}
             
-            # Add specific analysis instructions
-            prompt += f"""
-            User Question: {user_message}
-            Please provide a comprehensive answer based on the available documents:"""
+            def passage_text(item):
+                doc = docs_by_key.get(item['doc_id'])
+                return doc['content'][item['start']:item['end']] if doc else None
             
-            try:
-                # Configure Gemini
-                # Generate response
-                response = client.models.generate_content(model = 'gemini-2.0-flash',contents=prompt)
+            def passage_changed(item):
+                text = passage_text(item)
+                return text is None or doc_signature(text) != item['digest']
+            
+            with timed('prompt'):
+                selected = [passage_item(docs_by_key[chunk['doc_id']], chunk) for chunk in chunks]
+                
+                # Passages from earlier turns whose document changed or went away invalidate the context
+                if any(passage_changed(item) for item in conversation.base_items + conversation.extra_items):
+                    conversation.reset_context()
+                base_key = context_fingerprint((item['key'], passage_text(item)) for item in selected)
+                base_items, extra_items = conversation.plan_context(selected, base_key, RETRIEVAL_TOKEN_BUDGET // 2)
                 
-                return jsonify({
-                    "response": response.text,
-                    "sources": [doc['course_name'] for doc in context_docs]
-                })
+                # The base block stays the same across follow-ups, so it is assembled once
+                base_block = context_blocks.get(('all', conversation.base_key))
+                if base_block is None:
+                    base_block = build_passages(base_items, passage_text, min(RETRIEVAL_TOKEN_BUDGET, PROMPT_TOKEN_BUDGET))
+                    context_blocks.set(('all', conversation.base_key), base_block)
+                base, base_used = base_block
+                extra, extra_used = build_passages(extra_items, passage_text, RETRIEVAL_TOKEN_BUDGET // 2)
+                extra_text = f"Additional passages:\n\n{extra['text']}" if extra['text'] else ''
+                turn = conversation_prompt(conversation, ('all', conversation.base_key), system, base['text'], base['used_tokens'],
+                                           extra_text, extra['used_tokens'],
+                                           f"User Question: {user_message}\n"
+                                           "Please provide a comprehensive answer based on the available documents:")
+            prompt_tokens.observe(turn['tokens']['used'], endpoint_label())
+            used_chunks = base_used + extra_used
             
-            except Exception as e:
-                print(f"Gemini API error: {str(e)}")  # For debugging
-                return jsonify({"error": f"Error generating response: {str(e)}"}), 500
+            with timed('coverage'):
+                terms = term_indexes.get(f"user:{session['user_id']}",
+                                         [(doc['row'], doc['content']) for doc in context_docs])
+            
+            meta = {
+                **coverage_meta(user_message, terms),
+                "sources": [passage_source(item) for item in used_chunks] + skipped,
+                "tokens": {**turn['tokens'], "dropped": base['dropped_tokens'] + base['duplicate_tokens'] +
+                           extra['dropped_tokens'] + extra['duplicate_tokens']}
+            }
+            
+            tags = [f"user:{session['user_id']}"] + [f"syllabus:{syllabus_id}" for syllabus_id in {item['syllabus_id'] for item in used_chunks}]
+            return answer(turn, meta, user_message, tags, conversation)
             
     except Exception as e:
         print(f"Chat function error: {str(e)}")  # For debugging
@@ -349,29 +1060,33 @@ def view_syllabus(syllabus_id):
         return redirect(url_for('login'))
     
     try:
-        # Check if both tokens exist in session before using them
-        if 'access_token' in session and 'refresh_token' in session:
-            supabase.auth.set_session(session['access_token'], session['refresh_token'])
-        else:
+        db = get_db()
+        if db is None:
             flash('Session expired. Please log in again.', 'error')
             return redirect(url_for('login'))
         
         # Get syllabus data
-        syllabus_response = supabase.table('syllabi').select('*').eq('id', syllabus_id).execute()
-        if not syllabus_response.data:
+        syllabus = cached_syllabus(db, syllabus_id)
+        if not syllabus:
             flash('Syllabus not found', 'error')
             return redirect(url_for('dashboard'))
         
-        syllabus = syllabus_response.data[0]
-        
         # Check if user owns this syllabus
         if syllabus['user_id'] != session['user_id']:
             flash('You do not have permission to view this syllabus', 'error')
             return redirect(url_for('dashboard'))
         
-        # Get related documents
-        # documents_response = supabase.table('syllabi').select('*').eq('syllabus_id', syllabus_id).execute()
-        # documents = documents_response.data
+        # Common questions are answered in the background the first time a syllabus is viewed
+        # without current answers; the page shows them once they are stored
+        faq = syllabus.get('faq')
+        faq_pending = False
+        if syllabus.get('extraction_status') == STATUS_READY or syllabus.get('content_type') == 'text':
+            text_row = cached_syllabus(db, syllabus_id, columns=data_access.SYLLABUS_TEXT_COLUMNS)
+            text = row_text(text_row)
+            if text and not faq_is_current(faq, text):
+                faq_pending = True
+                queue_faq(syllabus_id, syllabus.get('course_name'), text,
+                          session['access_token'], session['user_id'])
         
         # No additional analysis needed for syllabus content
         
@@ -386,25 +1101,10 @@ def view_syllabus(syllabus_id):
                 answer = "This is a simulated answer to your question."
                 warning = None
                 
-                # Check if the question is covered by the documents
-                # This is a simplified check - in reality, you'd use semantic search or an LLM
-                question_keywords = question.lower().split()
-                content_to_check = ""
-                
-                if syllabus['content_type'] == 'text' and 'content' in syllabus and syllabus['content']:
-                    content_to_check += syllabus['content'].lower()
-                
-                # Add document content if available
-                # for doc in documents:
-                #     if doc['content_type'] == 'text' and 'content' in doc and doc['content']:
-                #         content_to_check += " " + doc['content'].lower()
-                
-                # Simple keyword matching to determine if question is covered
-                # In a real implementation, this would use more sophisticated NLP techniques
-                covered = any(keyword in content_to_check for keyword in question_keywords if len(keyword) > 3)
-                
-                if not covered:
-                    warning = "This question may not be covered by the available documents. The answer might not be accurate."
+                # Check if the question is covered by the syllabus and its documents
+                with timed('coverage'):
+                    text_row = cached_syllabus(db, syllabus_id, columns=data_access.SYLLABUS_TEXT_COLUMNS)
+                    warning = coverage_meta(question, syllabus_terms(db, text_row)).get('warning')
                 
                 question_result = {
                     'answer': answer,
@@ -412,7 +1112,8 @@ def view_syllabus(syllabus_id):
                 }
         
         return render_template('syllabus_detail.html', syllabus=syllabus, 
-                               question_result=question_result, question=question)
+                               question_result=question_result, question=question,
+                               faq=None if faq_pending else faq, faq_pending=faq_pending)
     
     except Exception as e:
         flash(f'Error: {str(e)}', 'error')
@@ -424,18 +1125,15 @@ def syllabus_chat(syllabus_id):
         return jsonify({"error": "Please log in to access the chatbot."}), 401
 
     try:
-        if 'access_token' in session and 'refresh_token' in session:
-            supabase.auth.set_session(session['access_token'], session['refresh_token'])
-        else:
+        db = get_db()
+        if db is None:
             return jsonify({"error": "Session expired. Please log in again."}), 401
 
         # Get syllabus data
-        syllabus_response = supabase.table('syllabi').select('*').eq('id', syllabus_id).execute()
-        if not syllabus_response.data:
+        syllabus = cached_syllabus(db, syllabus_id, columns=data_access.SYLLABUS_TEXT_COLUMNS)
+        if not syllabus:
             return jsonify({"error": "Syllabus not found."}), 404
 
-        syllabus = syllabus_response.data[0]
-
         # Check if user owns this syllabus
         if syllabus['user_id'] != session['user_id']:
             return jsonify({"error": "You do not have permission to access this syllabus."}), 403
@@ -443,29 +1141,78 @@ def syllabus_chat(syllabus_id):
         # Handle chatbot request
         data = request.get_json()
         user_message = data.get('message')
+        conversation = conversations.get_or_create(session['user_id'], f"syllabus:{syllabus_id}", data.get('conversation_id'))
 
-        # Prepare context for the chatbot
-        context = f"Syllabus: {syllabus.get('course_name', 'Untitled Course')}\n"
-        if syllabus.get('content'):
-            context += f"Content:\n{syllabus['content']}\n"
-        elif syllabus.get('file_path'):
-            extracted_text = extract_text_from_file(syllabus['file_path'])
-            context += f"Extracted Content:\n{extracted_text}\n"
+        # Stored answers to the common questions, then the extracted facts, before asking Gemini
+        text = row_text(syllabus)
+        if text and faq_is_current(syllabus.get('faq'), text):
+            item = match_faq(user_message, syllabus['faq'], extract_terms(syllabus.get('course_name') or ''))
+            if item is not None:
+                return conversation_reply(conversation, user_message, item['answer'],
+                                          {"faq": True, "cached": False, "question": item['question']})
 
-        # Generate response using Gemini
-        prompt = f"""
-        You are SylliAI, an AI assistant specialized in analyzing course syllabi.
-        Based on the following syllabus, answer the user's question:
+        found = facts_answer(user_message, [syllabus])
+        if found is not None:
+            return conversation_reply(conversation, user_message, *found)
 
-        {context}
+        # Prepare context for the chatbot from the text extracted at upload time
+        with timed('db'):
+            documents = cached_documents(db, syllabus['id'])
+        docs, skipped = load_context_docs([syllabus], documents)
+        if docs and docs[0]['document_id'] is None:
+            content = docs[0]['content']
+        elif skipped[0]['reason'] == 'failed':
+            return jsonify({"error": "We could not read this syllabus file. Try uploading it again."}), 422
+        else:
+            return jsonify({"error": "This syllabus is still being processed. Please try again in a moment."}), 409
+        attached = docs[1:]
 
-        User Question: {user_message}
-        """
-        try:
-            response = client.models.generate_content(model='gemini-2.0-flash', contents=prompt)
-            return jsonify({"response": response.text})
-        except Exception as e:
-            return jsonify({"error": f"Error generating response: {str(e)}"}), 500
+        # The same syllabus text always makes the same context block, so it is assembled once
+        with timed('prompt'):
+            block_key = ('syllabus', context_fingerprint([(syllabus['id'], content)]))
+            built = context_blocks.get(block_key)
+            if built is None:
+                builder = PromptBuilder(PROMPT_TOKEN_BUDGET, per_doc_cap=PROMPT_DOC_TOKEN_CAP)
+                builder.add(syllabus['id'], f"Syllabus: {syllabus.get('course_name', 'Untitled Course')}\nContent:\n", content)
+                built = builder.build()
+                context_blocks.set(block_key, built)
+
+        # The passages of the attached documents most relevant to this question follow the syllabus
+        extra_text = ''
+        extra_tokens = dropped_tokens = 0
+        used = []
+        if attached:
+            with timed('retrieval'):
+                index = retrieval_indexes.get(session['user_id'], docs, syllabus_id=syllabus['id'])
+                budget = max(0, min(RETRIEVAL_TOKEN_BUDGET, PROMPT_TOKEN_BUDGET - built['used_tokens']))
+                chunks = select_chunks(index, user_message, top_k=RETRIEVAL_TOP_K, token_budget=budget,
+                                       doc_ids={doc['key'] for doc in attached})
+            with timed('prompt'):
+                docs_by_key = {doc['key']: doc for doc in attached}
+                extra, used = build_passages([passage_item(docs_by_key[chunk['doc_id']], chunk) for chunk in chunks],
+                                             lambda item: docs_by_key[item['doc_id']]['content'][item['start']:item['end']],
+                                             budget)
+                if extra['text']:
+                    extra_text = f"Related course documents:\n\n{extra['text']}"
+                extra_tokens = extra['used_tokens']
+                dropped_tokens = extra['dropped_tokens'] + extra['duplicate_tokens']
+
+        with timed('prompt'):
+            system = """You are SylliAI, an AI assistant specialized in analyzing course syllabi.
+        Based on the following syllabus and related course documents, answer the user's question:"""
+            turn = conversation_prompt(conversation, block_key, system, built['text'], built['used_tokens'],
+                                       extra_text, extra_tokens, f"User Question: {user_message}")
+        prompt_tokens.observe(turn['tokens']['used'], endpoint_label())
+
+        with timed('coverage'):
+            terms = syllabus_terms(db, syllabus)
+        meta = {
+            **coverage_meta(user_message, terms),
+            "tokens": {**turn['tokens'], "dropped": built['dropped_tokens'] + built['duplicate_tokens'] + dropped_tokens}
+        }
+        if used or skipped:
+            meta["sources"] = [passage_source(item) for item in used] + skipped
+        return answer(turn, meta, user_message, [f"syllabus:{syllabus_id}"], conversation)
 
     except Exception as e:
         return jsonify({"error": f"Error: {str(e)}"}), 500
@@ -477,25 +1224,25 @@ def delete_syllabus(syllabus_id):
         return redirect(url_for('login'))
     
     try:
-        # Check if both tokens exist in session before using them
-        if 'access_token' in session and 'refresh_token' in session:
-            supabase.auth.set_session(session['access_token'], session['refresh_token'])
-        else:
+        db = get_db()
+        if db is None:
             flash('Session expired. Please log in again.', 'error')
             return redirect(url_for('login'))
         
         # Check if syllabus exists and belongs to user
-        syllabus_response = supabase.table('syllabi').select('*').eq('id', syllabus_id).eq('user_id', session['user_id']).execute()
-        
-        if not syllabus_response.data:
+        syllabus = data_access.get_syllabus(db, syllabus_id, columns='id,file_path', user_id=session['user_id'])
+        if not syllabus:
             flash('Syllabus not found or you do not have permission to delete it', 'error')
             return redirect(url_for('dashboard'))
-        
-        # Delete related documents first
-        # supabase.table('documents').delete().eq('syllabus_id', syllabus_id).execute()
+        document_files = data_access.list_document_files(db, syllabus_id, session['user_id'])
         
         # Delete the syllabus
-        supabase.table('syllabi').delete().eq('id', syllabus_id).execute()
+        db.table('syllabi').delete().eq('id', syllabus_id).execute()
+        for file_path in [syllabus.get('file_path')] + document_files:
+            blob_store.release(file_path)
+        retrieval_indexes.remove_syllabus(session['user_id'], syllabus['id'])
+        answer_cache.invalidate_syllabus(syllabus_id)
+        metadata_cache.invalidate_user(session['user_id'])
         
         flash('Syllabus and related documents deleted successfully', 'success')
         return redirect(url_for('dashboard'))
@@ -511,22 +1258,19 @@ def upload_document(syllabus_id):
         return redirect(url_for('login'))
     
     try:
-        # Check if both tokens exist in session before using them
-        if 'access_token' in session and 'refresh_token' in session:
-            supabase.auth.set_session(session['access_token'], session['refresh_token'])
-        else:
+        db = get_db()
+        if db is None:
             flash('Session expired. Please log in again.', 'error')
             return redirect(url_for('login'))
         
         # Check if syllabus exists and belongs to user
-        syllabus_response = supabase.table('syllabi').select('*').eq('id', syllabus_id).eq('user_id', session['user_id']).execute()
+        with timed('db'):
+            syllabus = data_access.get_syllabus(db, syllabus_id, columns='id,course_name', user_id=session['user_id'])
         
-        if not syllabus_response.data:
+        if not syllabus:
             flash('Syllabus not found or you do not have permission to add documents to it', 'error')
             return redirect(url_for('dashboard'))
         
-        syllabus = syllabus_response.data[0]
-        
         if request.method == 'POST':
             upload_type = request.form.get('upload_type')
             document_name = request.form.get('document_name')
@@ -544,32 +1288,55 @@ def upload_document(syllabus_id):
                 
                 if file and allowed_file(file.filename):
                     filename = secure_filename(file.filename)
-                    unique_filename = f"{uuid.uuid4()}_{filename}"
-                    file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-                    file.save(file_path)
+                    try:
+                        with timed('save'):
+                            file_path, _, _ = blob_store.put(file.stream, filename.rsplit('.', 1)[1])
+                    except BlobTooLarge as e:
+                        flash(str(e), 'error')
+                        return redirect(request.url)
                     
-                    supabase.table('documents').insert({
-                        "user_id": session['user_id'],
-                        "syllabus_id": syllabus_id,
-                        "name": document_name,
-                        "document_type": document_type,
-                        "file_path": file_path,
-                        "content_type": "file"
-                    }).execute()
+                    with timed('db'):
+                        try:
+                            insert_response = db.table('documents').insert({
+                                "user_id": session['user_id'],
+                                "syllabus_id": syllabus_id,
+                                "name": document_name,
+                                "document_type": document_type,
+                                "file_path": file_path,
+                                "content_type": "file",
+                                "extraction_status": STATUS_PENDING
+                            }).execute()
+                        except Exception:
+                            blob_store.release(file_path)
+                            raise
+                    with timed('queue'):
+                        queue_extraction('documents', insert_response.data[0]['id'], file_path,
+                                         syllabus['course_name'], syllabus['id'])
+                    answer_cache.invalidate_syllabus(syllabus_id)
+                    metadata_cache.invalidate_user(session['user_id'])
                     
                     flash('Document uploaded successfully!', 'success')
                     return redirect(url_for('view_syllabus', syllabus_id=syllabus_id))
             else:
                 content = request.form.get('content')
                 
-                supabase.table('documents').insert({
-                    "user_id": session['user_id'],
-                    "syllabus_id": syllabus_id,
-                    "name": document_name,
-                    "document_type": document_type,
-                    "content": content,
-                    "content_type": "text"
-                }).execute()
+                with timed('normalize'):
+                    fields = text_fields(normalize_text(content or ''))
+                with timed('db'):
+                    insert_response = db.table('documents').insert({
+                        "user_id": session['user_id'],
+                        "syllabus_id": syllabus_id,
+                        "name": document_name,
+                        "document_type": document_type,
+                        "content": content,
+                        "content_type": "text",
+                        **fields
+                    }).execute()
+                with timed('retrieval'):
+                    retrieval_indexes.add(session['user_id'], index_doc('documents', insert_response.data[0]['id'], syllabus['id'],
+                                                                        syllabus['course_name'], fields['extracted_text']))
+                answer_cache.invalidate_syllabus(syllabus_id)
+                metadata_cache.invalidate_user(session['user_id'])
                 
                 flash('Document content saved successfully!', 'success')
                 return redirect(url_for('view_syllabus', syllabus_id=syllabus_id))
@@ -580,6 +1347,78 @@ def upload_document(syllabus_id):
         flash(f'Error: {str(e)}', 'error')
         return redirect(url_for('dashboard'))
 
+@app.route('/syllabus/<syllabus_id>/documents/bulk', methods=['POST'])
+def bulk_upload_documents(syllabus_id):
+    # Many files in one multipart request ("files" repeated), stored and inserted as one batch
+    if 'user_id' not in session:
+        return jsonify({"error": "Please log in to upload documents."}), 401
+
+    try:
+        db = get_db()
+        if db is None:
+            return jsonify({"error": "Session expired. Please log in again."}), 401
+
+        syllabus = cached_syllabus(db, syllabus_id, columns='id,user_id,course_name')
+        if not syllabus or syllabus['user_id'] != session['user_id']:
+            return jsonify({"error": "Syllabus not found or you do not have permission to add documents to it."}), 404
+
+        files = request.files.getlist('files')
+        if not files:
+            return jsonify({"error": "No files were uploaded."}), 400
+        if len(files) > MAX_BULK_FILES:
+            return jsonify({"error": f"Upload at most {MAX_BULK_FILES} files at a time."}), 400
+
+        document_type = request.form.get('document_type') or 'other'
+        results = []
+        rows = []
+        with timed('save'):
+            for file in files:
+                result = {"filename": file.filename}
+                results.append(result)
+                if not file.filename or not allowed_file(file.filename):
+                    result.update(status="rejected", error="Accepted formats: PDF, DOCX, TXT")
+                    continue
+                filename = secure_filename(file.filename)
+                try:
+                    file_path, _, size = blob_store.put(file.stream, filename.rsplit('.', 1)[1])
+                except BlobTooLarge as e:
+                    result.update(status="rejected", error=str(e))
+                    continue
+                result['size'] = size
+                rows.append((result, {
+                    "user_id": session['user_id'],
+                    "syllabus_id": syllabus_id,
+                    "name": filename.rsplit('.', 1)[0],
+                    "document_type": document_type,
+                    "file_path": file_path,
+                    "content_type": "file",
+                    "extraction_status": STATUS_PENDING
+                }))
+
+        if rows:
+            try:
+                with timed('db'):
+                    inserted = db.table('documents').insert([row for _, row in rows]).execute().data
+            except Exception as e:
+                print(f"Error inserting documents: {str(e)}")
+                for result, row in rows:
+                    blob_store.release(row['file_path'])
+                    result.update(status="error", error="Could not save this document.")
+                return jsonify({"syllabus_id": syllabus_id, "documents": results}), 500
+
+            with timed('queue'):
+                for (result, row), document in zip(rows, inserted):
+                    queue_extraction('documents', document['id'], row['file_path'], syllabus['course_name'], syllabus['id'])
+                    result.update(status="queued", id=document['id'])
+            answer_cache.invalidate_syllabus(syllabus_id)
+            metadata_cache.invalidate_user(session['user_id'])
+
+        return jsonify({"syllabus_id": syllabus_id, "documents": results}), 200 if rows else 400
+
+    except Exception as e:
+        print(f"Bulk upload error: {str(e)}")  # For debugging
+        return jsonify({"error": f"Error uploading documents: {str(e)}"}), 500
+
 @app.route('/delete_document/<document_id>')
 def delete_document(document_id):
     if 'user_id' not in session:
@@ -587,25 +1426,25 @@ def delete_document(document_id):
         return redirect(url_for('login'))
     
     try:
-        # Check if both tokens exist in session before using them
-        if 'access_token' in session and 'refresh_token' in session:
-            supabase.auth.set_session(session['access_token'], session['refresh_token'])
-        else:
+        db = get_db()
+        if db is None:
             flash('Session expired. Please log in again.', 'error')
             return redirect(url_for('login'))
         
         # Get document to find its syllabus_id
-        document_response = supabase.table('documents').select('*').eq('id', document_id).eq('user_id', session['user_id']).execute()
+        document = data_access.get_document(db, document_id, session['user_id'], columns='id,syllabus_id,file_path')
         
-        if not document_response.data:
+        if not document:
             flash('Document not found or you do not have permission to delete it', 'error')
             return redirect(url_for('dashboard'))
-        
-        document = document_response.data[0]
         syllabus_id = document['syllabus_id']
         
         # Delete the document
-        supabase.table('documents').delete().eq('id', document_id).execute()
+        db.table('documents').delete().eq('id', document_id).execute()
+        blob_store.release(document.get('file_path'))
+        retrieval_indexes.remove(session['user_id'], f"document:{document['id']}")
+        answer_cache.invalidate_syllabus(syllabus_id)
+        metadata_cache.invalidate_user(session['user_id'])
         
         flash('Document deleted successfully', 'success')
         return redirect(url_for('view_syllabus', syllabus_id=syllabus_id))
@@ -621,21 +1460,17 @@ def view_document(document_id):
         return redirect(url_for('login'))
     
     try:
-        # Check if both tokens exist in session before using them
-        if 'access_token' in session and 'refresh_token' in session:
-            supabase.auth.set_session(session['access_token'], session['refresh_token'])
-        else:
+        db = get_db()
+        if db is None:
             flash('Session expired. Please log in again.', 'error')
             return redirect(url_for('login'))
         
         # Get document
-        document_response = supabase.table('documents').select('*').eq('id', document_id).eq('user_id', session['user_id']).execute()
+        document = data_access.get_document(db, document_id, session['user_id'])
         
-        if not document_response.data:
+        if not document:
             flash('Document not found or you do not have permission to view it', 'error')
             return redirect(url_for('dashboard'))
-        
-        document = document_response.data[0]
         syllabus_id = document['syllabus_id']
         
         # For now, just redirect to the syllabus detail page
@@ -660,34 +1495,30 @@ def view_syllabus_file(syllabus_id):
         return redirect(url_for('login'))
     
     try:
-        # Check if both tokens exist in session before using them
-        if 'access_token' in session and 'refresh_token' in session:
-            supabase.auth.set_session(session['access_token'], session['refresh_token'])
-        else:
+        db = get_db()
+        if db is None:
             flash('Session expired. Please log in again.', 'error')
             return redirect(url_for('login'))
         
-        # Get syllabus data
-        syllabus_response = supabase.table('syllabi').select('*').eq('id', syllabus_id).execute()
-        if not syllabus_response.data:
+        # Get syllabus data; repeat views are answered from the metadata cache without a query
+        syllabus = cached_syllabus(db, syllabus_id, columns=data_access.SYLLABUS_FILE_COLUMNS)
+        if not syllabus:
             flash('Syllabus not found', 'error')
             return redirect(url_for('dashboard'))
         
-        syllabus = syllabus_response.data[0]
-        
         # Check if user owns this syllabus
         if syllabus['user_id'] != session['user_id']:
             flash('You do not have permission to view this syllabus', 'error')
             return redirect(url_for('dashboard'))
         
-        # Check if syllabus has a file
-        if syllabus['content_type'] != 'file' or not syllabus['file_path']:
+        # Check if syllabus has a file (file uploads are stored as "PDF File", "DOCX File", ...)
+        if syllabus['content_type'] == 'text' or not syllabus['file_path']:
             flash('No file available for this syllabus', 'error')
             return redirect(url_for('view_syllabus', syllabus_id=syllabus_id))
         
         # Serve the file
-        file_path = syllabus['file_path']
-        return send_file(file_path, as_attachment=False)
+        with timed('send'):
+            return serve_upload(syllabus['file_path'])
     
     except Exception as e:
         flash(f'Error viewing syllabus file: {str(e)}', 'error')
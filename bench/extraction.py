@@ -0,0 +1,57 @@
+import argparse
+import glob
+import os
+import time
+import tracemalloc
+
+import pdfplumber
+
+from extraction import extract_text_from_file
+
+
+# Compares the page-wise extraction engine with the old whole-document
+# pdfplumber loop on the PDFs in uploads/.
+#
+#   python -m bench.extraction --repeat 3
+
+
+def legacy_extract(file_path):
+    with pdfplumber.open(file_path) as pdf:
+        text = ''
+        for page in pdf.pages:
+            text += page.extract_text() or ''
+    return text.strip()
+
+
+def measure(extract, file_path, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        text = extract(file_path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    # Memory is traced in a separate run since tracemalloc slows parsing down a lot
+    tracemalloc.start()
+    extract(file_path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, len(text or '')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', default=os.path.join('uploads', '*.pdf'))
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'file':<40} {'engine':<8} {'seconds':>8} {'peak MiB':>9} {'chars':>7}")
+    for file_path in sorted(glob.glob(args.files)):
+        name = os.path.basename(file_path)[-40:]
+        for label, extract in (('legacy', legacy_extract), ('paged', extract_text_from_file)):
+            elapsed, peak, chars = measure(extract, file_path, args.repeat)
+            print(f"{name:<40} {label:<8} {elapsed:>8.3f} {peak / 1024 / 1024:>9.1f} {chars:>7}")
+
+
+if __name__ == '__main__':
+    main()
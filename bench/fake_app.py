@@ -0,0 +1,30 @@
+import os
+
+import app as app_module
+from bench.fakes import FakeGenai, FakePool, FakeSupabase
+
+
+# Run the real Flask app against local fakes, e.g.
+#   gunicorn -c gunicorn.conf.py bench.fake_app:app
+
+app_module.supabase = FakeSupabase()
+app_module.supabase_pool = FakePool(app_module.supabase)
+app_module.client = FakeGenai()
+
+SYLLABUS_WORDS = int(os.getenv("FAKE_SYLLABUS_WORDS", 3000))
+SYLLABUS_COUNT = int(os.getenv("FAKE_SYLLABUS_COUNT", 6))
+
+for n in range(SYLLABUS_COUNT):
+    content = ' '.join(f"policy{n} exam grade attendance late week{i % 15}" for i in range(SYLLABUS_WORDS // 7))
+    app_module.supabase.tables['syllabi'].append({
+        'id': f"syllabus-{n}",
+        'user_id': app_module.supabase.auth.user_id,
+        'course_name': f"Course {n}",
+        'content': content,
+        'content_type': 'text',
+        'extracted_text': content,
+        'extraction_status': 'ready',
+        'created_at': f"2025-01-01T00:00:{n:02d}"
+    })
+
+app = app_module.app
@@ -0,0 +1,280 @@
+import itertools
+import json
+import os
+import time
+import types
+import uuid
+
+
+# Stand-ins for the Supabase and genai clients used by app.py. Every call sleeps
+# for a configurable latency so worker and caching behaviour can be measured
+# without live services.
+
+SUPABASE_LATENCY = float(os.getenv("FAKE_SUPABASE_LATENCY_MS", 50)) / 1000
+GEMINI_LATENCY = float(os.getenv("FAKE_GEMINI_LATENCY_MS", 1500)) / 1000
+GEMINI_STREAM_CHUNKS = int(os.getenv("FAKE_GEMINI_STREAM_CHUNKS", 20))
+
+
+class FakeResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+def _conditions(filters):
+    # Splits at top-level commas, outside "and(...)" groups and quoted values
+    parts, current, depth, quoted = [], '', 0, False
+    for ch in filters:
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch in '()':
+            depth += 1 if ch == '(' else -1
+        elif not quoted and ch == ',' and depth == 0:
+            parts.append(current)
+            current = ''
+            continue
+        current += ch
+    parts.append(current)
+
+    conditions = []
+    for part in parts:
+        if part.startswith('and('):
+            group = _conditions(part[4:-1])
+            conditions.append(lambda row, group=group: all(condition(row) for condition in group))
+        else:
+            conditions.append(_condition(*part.split('.', 2)))
+    return conditions
+
+
+def _condition(column, op, value):
+    column, _, key = column.partition('->>')
+    value = value.strip('"')
+
+    def get(row):
+        current = row.get(column)
+        if key and current is not None:
+            current = (json.loads(current) if isinstance(current, str) else current).get(key)
+            current = None if current is None else str(current)
+        return current
+
+    if op == 'is':
+        return lambda row: get(row) is None if value == 'null' else get(row) == value
+    if op == 'eq':
+        return lambda row: get(row) is not None and str(get(row)) == value
+    if op == 'neq':
+        return lambda row: get(row) is not None and str(get(row)) != value
+    if op == 'lt':
+        return lambda row: get(row) is not None and str(get(row)) < value
+    raise ValueError(f"Unsupported filter operator: {op}")
+
+
+class FakeQuery:
+    def __init__(self, backend, table):
+        self.backend = backend
+        self.table = table
+        self.op = 'select'
+        self.columns = None
+        self.payload = None
+        self.filters = []
+        self.ordering = []
+        self.row_limit = None
+        self.count = None
+        self.head = False
+
+    def select(self, *columns, count=None, head=False):
+        self.op = 'select'
+        self.columns = [c.strip() for column in columns for c in column.split(',') if c.strip() != '*'] or None
+        self.count = count
+        self.head = head
+        return self
+
+    def insert(self, payload):
+        self.op = 'insert'
+        self.payload = payload
+        return self
+
+    def update(self, payload):
+        self.op = 'update'
+        self.payload = payload
+        return self
+
+    def delete(self):
+        self.op = 'delete'
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: str(row.get(column)) == str(value))
+        return self
+
+    def in_(self, column, values):
+        values = {str(v) for v in values}
+        self.filters.append(lambda row: str(row.get(column)) in values)
+        return self
+
+    def lt(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row.get(column) < value)
+        return self
+
+    def gt(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row.get(column) > value)
+        return self
+
+    def gte(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row.get(column) >= value)
+        return self
+
+    def is_(self, column, value):
+        # PostgREST's "is.null"; other values compare as given
+        if value == 'null':
+            self.filters.append(lambda row: row.get(column) is None)
+        else:
+            self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def or_(self, filters):
+        # PostgREST's "column.op.value,and(...),..."; columns may reach into JSON with "->>"
+        conditions = _conditions(filters)
+        self.filters.append(lambda row: any(condition(row) for condition in conditions))
+        return self
+
+    def order(self, column, desc=False):
+        self.ordering.append((column, desc))
+        return self
+
+    def limit(self, n):
+        self.row_limit = n
+        return self
+
+    def execute(self):
+        time.sleep(SUPABASE_LATENCY)
+        rows = self.backend.tables.setdefault(self.table, [])
+
+        if self.op == 'insert':
+            payload = self.payload if isinstance(self.payload, list) else [self.payload]
+            inserted = []
+            for item in payload:
+                row = dict(item)
+                row.setdefault('id', str(uuid.uuid4()))
+                row.setdefault('created_at', f"2025-01-01T00:00:{next(self.backend.clock):012.6f}")
+                rows.append(row)
+                inserted.append(row)
+            return FakeResponse(inserted)
+
+        matched = [row for row in rows if all(f(row) for f in self.filters)]
+        if self.op == 'update':
+            for row in matched:
+                row.update(self.payload)
+            return FakeResponse(matched)
+        if self.op == 'delete':
+            for row in matched:
+                rows.remove(row)
+            return FakeResponse(matched)
+
+        # Stable sorts from the last key to the first give PostgREST's multi-column order
+        for column, desc in reversed(self.ordering):
+            matched.sort(key=lambda row: row.get(column) or '', reverse=desc)
+        count = len(matched) if self.count else None
+        if self.row_limit is not None:
+            matched = matched[:self.row_limit]
+        if self.columns:
+            matched = [{c: row.get(c) for c in self.columns} for row in matched]
+        return FakeResponse([] if self.head else matched, count=count)
+
+
+class FakeAuth:
+    def __init__(self, user_id):
+        self.user_id = user_id
+
+    def _session(self):
+        return types.SimpleNamespace(
+            user=types.SimpleNamespace(id=self.user_id),
+            session=types.SimpleNamespace(access_token=f"access-{uuid.uuid4()}", refresh_token=f"refresh-{uuid.uuid4()}")
+        )
+
+    def sign_up(self, credentials):
+        time.sleep(SUPABASE_LATENCY)
+        return self._session()
+
+    def sign_in_with_password(self, credentials):
+        time.sleep(SUPABASE_LATENCY)
+        return self._session()
+
+    def set_session(self, access_token, refresh_token):
+        time.sleep(SUPABASE_LATENCY)
+
+    def refresh_session(self, refresh_token):
+        time.sleep(SUPABASE_LATENCY)
+        return self._session()
+
+
+class FakeSupabase:
+    def __init__(self, user_id='bench-user'):
+        self.tables = {'users': [], 'syllabi': [], 'documents': []}
+        self.clock = itertools.count()
+        self.auth = FakeAuth(user_id)
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+
+class FakeCaches:
+    # Context caches as the genai client exposes them: created from contents, referenced by name
+    def __init__(self):
+        self.entries = {}
+
+    def create(self, model, contents, config=None):
+        time.sleep(SUPABASE_LATENCY)
+        name = f"cachedContents/{uuid.uuid4().hex}"
+        self.entries[name] = (model, contents, config)
+        return types.SimpleNamespace(name=name, model=model)
+
+    def delete(self, name, config=None):
+        self.entries.pop(name, None)
+
+
+class FakeModels:
+    def __init__(self, answer, caches):
+        self.answer = answer
+        self.caches = caches
+        self.calls = 0
+        self.cached_calls = 0
+
+    def _check_config(self, config):
+        cached_content = (config or {}).get('cached_content')
+        if cached_content is not None:
+            if cached_content not in self.caches.entries:
+                raise ValueError(f"404 NOT_FOUND: {cached_content}")
+            self.cached_calls += 1
+
+    def generate_content(self, model, contents, config=None):
+        self.calls += 1
+        self._check_config(config)
+        time.sleep(GEMINI_LATENCY)
+        return types.SimpleNamespace(text=self.answer)
+
+    def generate_content_stream(self, model, contents, config=None):
+        self.calls += 1
+        self._check_config(config)
+        words = self.answer.split(' ')
+        per_chunk = max(1, len(words) // GEMINI_STREAM_CHUNKS)
+        for i in range(0, len(words), per_chunk):
+            time.sleep(GEMINI_LATENCY / GEMINI_STREAM_CHUNKS)
+            yield types.SimpleNamespace(text=' '.join(words[i:i + per_chunk]) + ' ')
+
+
+class FakeGenai:
+    def __init__(self, answer_words=int(os.getenv("FAKE_GEMINI_ANSWER_WORDS", 120))):
+        self.caches = FakeCaches()
+        self.models = FakeModels(' '.join(['answer'] * answer_words), self.caches)
+
+
+class FakePool:
+    # Replaces app.supabase_pool; every user shares the fake backend
+    def __init__(self, backend):
+        self.backend = backend
+
+    def client_for(self, access_token, refresh_token, user_id=None):
+        return self.backend, None
+
+    def background_client(self, access_token):
+        return self.backend
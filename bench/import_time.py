@@ -0,0 +1,87 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+# Measures how long a fresh worker takes to import the app: the cost every
+# gunicorn worker pays at boot and on recycling (or the master once, with
+# GUNICORN_PRELOAD=1). Each run is a new interpreter, started without Supabase
+# or Gemini credentials. Exits non-zero if the median import goes over the
+# budget in bench/baselines.json (or --budget) or if any SDK or parser that
+# should load lazily got imported, so it can run in CI.
+#
+#   python -m bench.import_time
+#   python -m bench.import_time --runs 10 --budget 0.3 --top 15
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINES = os.path.join(ROOT, 'bench', 'baselines.json')
+
+# Imported on first use only: by the first request that needs them or by the ingest pool
+LAZY_MODULES = ('google.genai', 'supabase', 'postgrest', 'httpx', 'pdfplumber', 'pypdf', 'docx')
+
+CREDENTIALS = ('SUPABASE_URL', 'SUPABASE_KEY', 'SUPABASE_JWT_SECRET', 'GEMINI_API_KEY')
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import app
+seconds = time.perf_counter() - start
+print(json.dumps({'seconds': seconds, 'loaded': [name for name in %r if name in sys.modules]}))
+""" % (LAZY_MODULES,)
+
+
+def run_once():
+    env = {key: value for key, value in os.environ.items() if key not in CREDENTIALS}
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    # -X importtime lines: "import time: self [us] | cumulative | imported package"
+    modules = []
+    for line in result.stderr.splitlines():
+        parts = line.split('|')
+        if line.startswith('import time:') and len(parts) == 3 and parts[1].strip().isdigit():
+            modules.append((int(parts[1]), parts[2].rstrip()))
+    return json.loads(result.stdout.strip().splitlines()[-1]), modules
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', type=float, help="max median seconds to import app (default: from --baselines)")
+    parser.add_argument('--baselines', default=BASELINES)
+    parser.add_argument('--top', type=int, default=10, help="slowest imports to list")
+    args = parser.parse_args()
+
+    budget = args.budget
+    if budget is None:
+        with open(args.baselines) as f:
+            budget = json.load(f)['import_time']['budget']
+
+    times = []
+    loaded = set()
+    modules = []
+    for _ in range(args.runs):
+        result, modules = run_once()
+        times.append(result['seconds'])
+        loaded.update(result['loaded'])
+
+    median = statistics.median(times)
+    print(f"import app: median {median:.3f} s, min {min(times):.3f} s, max {max(times):.3f} s over {args.runs} runs")
+    print("slowest imports (cumulative, last run):")
+    for microseconds, name in sorted(modules, reverse=True)[1:args.top + 1]:
+        print(f"  {microseconds / 1000:8.1f} ms {name}")
+
+    failed = False
+    if median > budget:
+        failed = True
+        print(f"OVER BUDGET: {median:.3f} s > {budget:.3f} s")
+    if loaded:
+        failed = True
+        print(f"EAGER IMPORTS: {', '.join(sorted(loaded))} should only load on first use")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import types
+
+import data_access
+from bench.fakes import FakeSupabase
+from extraction import extract_text_from_file
+from facts import answer_from_facts, extract_facts
+from faq import FAQ_QUESTIONS, FaqGenerator
+from ingest import IngestQueue
+from llm_gateway import GatewayError, LLMGateway
+from retrieval import RetrievalIndexes
+
+
+# Regression checks for behaviour the route benchmark cannot see, several of
+# them against the sample syllabi in uploads/. Exits non-zero if any check fails.
+#
+#   python -m bench.regressions
+#   python -m bench.regressions --only facts
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SWE_SYLLABUS = 'uploads/*Intermediate_Software_Design_and_Engineering.pdf'
+
+_texts = {}
+
+
+def sample_text(pattern):
+    path = glob.glob(os.path.join(ROOT, pattern))[0]
+    if path not in _texts:
+        _texts[path] = extract_text_from_file(path)
+    return _texts[path]
+
+
+def check_facts():
+    facts = extract_facts(sample_text(SWE_SYLLABUS))
+    courses = [(1, 'Intermediate Software Design', facts)]
+    for item in facts['dates']:
+        assert item['label'].isprintable(), f"label keeps unprintable characters: {item['label']!r}"
+        assert 'considered final' not in item['label'], f"prose taken for a date: {item['label']!r}"
+    # The syllabus has no final exam date, so this must go to Gemini rather than be answered with a near miss
+    assert answer_from_facts("When is the final exam?", courses) is None, "final exam answered from facts"
+    assert answer_from_facts("When is the final project due?", courses) is None, "final project answered from facts"
+    found = answer_from_facts("When are the quizzes?", courses)
+    assert found and 'Quiz 2: Use Cases in HokieSpa' in found[0], f"quiz dates missing: {found!r}"
+
+
+def check_ingest_store():
+    # A slow store must not hold up the results of other extractions
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for name in ('a.txt', 'b.txt'):
+            paths.append(os.path.join(tmp, name))
+            with open(paths[-1], 'w') as f:
+                f.write(f"Syllabus {name}\n")
+        queue = IngestQueue(os.path.join(tmp, 'cache'), max_workers=1)
+        queue.submit('documents', 1, paths[0], lambda *args: time.sleep(3)).result(timeout=30)
+        start = time.perf_counter()
+        queue.submit('documents', 2, paths[1], lambda *args: None).result(timeout=30)
+        elapsed = time.perf_counter() - start
+        assert elapsed < 1.5, f"extraction delayed {elapsed:.2f} s by another row's store"
+
+
+def check_extraction_cache_stats():
+    # Hits and misses in the pool processes are counted by the queue that submitted the jobs
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'a.txt')
+        with open(path, 'w') as f:
+            f.write("Syllabus\n")
+        queue = IngestQueue(os.path.join(tmp, 'cache'), max_workers=1)
+        for row_id in (1, 2):
+            queue.submit('documents', row_id, path, lambda *args: None).result(timeout=30)
+            time.sleep(0.1)
+        stats = queue.cache_stats()
+        assert (stats['hits'], stats['misses']) == (1, 1), f"extraction cache stats {stats!r}"
+
+
+def check_syllabi_pages():
+    # Rows inserted in one batch share created_at; paging must still return each exactly once
+    db = FakeSupabase()
+    db.tables['syllabi'] = [
+        {'id': f"s{i}", 'user_id': 'u1', 'course_name': f"Course {i}", 'content_type': 'text',
+         'created_at': '2025-01-01T00:00:00' if i < 5 else f"2025-01-0{i - 3}T00:00:00"}
+        for i in range(7)
+    ]
+    seen = []
+    cursor = None
+    while True:
+        rows, cursor = data_access.list_syllabi(db, 'u1', limit=2, cursor=cursor)
+        seen.extend(row['id'] for row in rows)
+        if cursor is None:
+            break
+    assert sorted(seen) == [f"s{i}" for i in range(7)], f"pages returned {seen!r}"
+
+
+def check_retrieval_snapshots():
+    # A save that snapshots first but writes last must not leave a stale snapshot behind
+    def doc(i):
+        return {'key': f"documents:{i}", 'syllabus_id': 's1', 'course_name': 'SWE', 'content': f"Syllabus copy {i}"}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        indexes = RetrievalIndexes(tmp)
+        index = indexes.get('u1', [])
+        take_snapshot = index.to_snapshot
+        slowed = []
+
+        def slow_snapshot():
+            snapshot = take_snapshot()
+            if not slowed:
+                slowed.append(True)
+                time.sleep(0.5)
+            return snapshot
+
+        index.to_snapshot = slow_snapshot
+        first = threading.Thread(target=indexes.add, args=('u1', doc(0)))
+        first.start()
+        time.sleep(0.1)
+        indexes.add('u1', doc(1))
+        first.join()
+        restored = RetrievalIndexes(tmp).get('u1', [], syllabus_id='none')
+        assert set(restored.docs) == {'documents:0', 'documents:1'}, f"snapshot holds {sorted(restored.docs)}"
+
+
+def check_faq_claim():
+    # Workers that each queue the same syllabus text make one Gemini call between them
+    db = FakeSupabase()
+    db.tables['syllabi'].append({'id': 's1'})
+    calls = []
+
+    def generate(prompt):
+        calls.append(prompt)
+        time.sleep(0.2)
+        return json.dumps({key: "Answer." for key, _, _, _ in FAQ_QUESTIONS})
+
+    def claim(key):
+        return data_access.claim_faq(db, 's1', key, 600)
+
+    def store(faq):
+        data_access.store_faq(db, 's1', faq)
+
+    text = sample_text(SWE_SYLLABUS)
+    workers = [FaqGenerator(), FaqGenerator()]
+    for future in [worker.submit('s1', 'SWE', text, generate, store, claim) for worker in workers]:
+        future.result(timeout=30)
+    workers[0].submit('s1', 'SWE', text, generate, store, claim).result(timeout=30)
+    assert len(calls) == 1, f"{len(calls)} FAQ calls for one text"
+    workers[1].submit('s1', 'SWE', text + "\nUpdated.", generate, store, claim).result(timeout=30)
+    assert len(calls) == 2, "changed text was not answered again"
+
+
+class SlowStreamModels:
+    # Streams three chunks 0.3 s apart, or fails after the first with ``error``
+    def __init__(self, error=None):
+        self.error = error
+
+    def generate_content_stream(self, model, contents, config=None):
+        for i in range(3):
+            if i and self.error:
+                raise self.error
+            time.sleep(0.3)
+            yield types.SimpleNamespace(text=f"part {i} ")
+
+
+def drain(chunks):
+    try:
+        for _ in chunks:
+            pass
+    except Exception:
+        pass
+
+
+def check_gateway_followers():
+    # A request coalesced onto an identical one streams with it and gets an error the route handles
+    for error in (None, RuntimeError("upstream broke")):
+        gateway = LLMGateway(lambda: models, 'model', flight_timeout=5)
+        models = SlowStreamModels(error)
+        leader = gateway.stream("same prompt")
+        started = time.perf_counter()
+        follower = gateway.stream("same prompt")
+        assert time.perf_counter() - started < 0.1, "follower blocked until the leader finished"
+        threading.Thread(target=drain, args=(leader,), daemon=True).start()
+        received = []
+        try:
+            for text in follower:
+                received.append((text, time.perf_counter() - started))
+        except GatewayError:
+            assert error is not None, "follower failed without the leader failing"
+        else:
+            assert error is None, "leader failure did not reach the follower as a GatewayError"
+            assert ''.join(text for text, _ in received) == "part 0 part 1 part 2 ", f"follower got {received!r}"
+            assert received[0][1] < 0.6, f"first chunk only after {received[0][1]:.2f} s"
+        follower.close()
+        leader.close()
+
+
+CHECKS = {
+    'facts': check_facts,
+    'ingest_store': check_ingest_store,
+    'extraction_cache_stats': check_extraction_cache_stats,
+    'syllabi_pages': check_syllabi_pages,
+    'retrieval_snapshots': check_retrieval_snapshots,
+    'faq_claim': check_faq_claim,
+    'gateway_followers': check_gateway_followers,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--only', help="comma-separated checks to run")
+    args = parser.parse_args()
+    names = args.only.split(',') if args.only else list(CHECKS)
+
+    failed = 0
+    for name in names:
+        try:
+            CHECKS[name]()
+            print(f"ok    {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"FAIL  {name}: {e}")
+        except Exception as e:
+            failed += 1
+            print(f"FAIL  {name}: {type(e).__name__}: {e}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
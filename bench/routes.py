@@ -0,0 +1,242 @@
+import argparse
+import http.client
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from bench.worker_modes import HOST, login, wait_for_server
+
+
+# Drives the main routes of bench.fake_app under concurrency and reports
+# latency percentiles, throughput and peak worker RSS per route. Each route
+# gets a fresh gunicorn so uploads and caches from one route do not leak into
+# the next, and so peak RSS is per route.
+#
+#   python -m bench.routes                   # compare against bench/baselines.json
+#   python -m bench.routes --save            # record new baselines
+#   python -m bench.routes --routes chat,dashboard --supabase-ms 20 --gemini-ms 800
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+
+
+def post_form(path, fields, cookie=None):
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    if cookie:
+        headers['Cookie'] = cookie
+    return 'POST', path, urlencode(fields), headers
+
+
+def post_json(path, payload, cookie):
+    return 'POST', path, json.dumps(payload), {
+        'Content-Type': 'application/json',
+        'Accept': 'application/json',
+        'Cookie': cookie
+    }
+
+
+# Each route builds its n-th request and says what a successful response looks like.
+# Questions differ per request so every chat goes through the model, not the answer cache,
+# and none of them can be answered from the facts extracted from the bench syllabi.
+ROUTES = {
+    'login': (
+        lambda n, cookie, args: post_form('/login', {'email': 'bench@example.com', 'password': 'bench'}),
+        (302, '/dashboard')
+    ),
+    'dashboard': (
+        lambda n, cookie, args: ('GET', '/dashboard', None, {'Cookie': cookie}),
+        (200, None)
+    ),
+    'upload': (
+        lambda n, cookie, args: post_form('/upload', {
+            'upload_type': 'text',
+            'course_name': f"Bench upload {n}",
+            'content': ('Week 1 reading and grading policy. ' * (args.upload_kb * 1024 // 36 + 1))[:args.upload_kb * 1024]
+        }, cookie),
+        (302, '/dashboard')
+    ),
+    'chat': (
+        lambda n, cookie, args: post_json('/chat', {'message': f"When is the late exam for week {n}?"}, cookie),
+        (200, None)
+    ),
+    'syllabus_chat': (
+        lambda n, cookie, args: post_json('/syllabus/syllabus-0/chat', {'message': f"What is the late work policy for week {n}?"}, cookie),
+        (200, None)
+    ),
+}
+
+
+def send(port, request, expected):
+    method, path, body, headers = request
+    start = time.perf_counter()
+    try:
+        conn = http.client.HTTPConnection(HOST, port, timeout=300)
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        status = response.status
+        location = response.getheader('Location') or ''
+    except OSError:
+        return False, time.perf_counter() - start
+    elapsed = time.perf_counter() - start
+
+    expected_status, expected_location = expected
+    ok = status == expected_status and (expected_location is None or location.endswith(expected_location))
+    return ok, elapsed
+
+
+def worker_pids(master_pid):
+    pids = []
+    try:
+        for task in os.listdir(f"/proc/{master_pid}/task"):
+            with open(f"/proc/{master_pid}/task/{task}/children") as f:
+                pids.extend(int(pid) for pid in f.read().split())
+    except OSError:
+        pass
+    return pids
+
+
+def peak_rss_bytes(pid):
+    # VmHWM is the high-water mark of resident memory; Linux only
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def percentile(sorted_values, pct):
+    # Nearest-rank, so p99 of a small sample is its slowest request rather than an interpolation
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def run_route(name, args):
+    build, expected = ROUTES[name]
+    env = dict(
+        os.environ,
+        GUNICORN_WORKER_CLASS=args.worker_class,
+        WEB_CONCURRENCY=str(args.workers),
+        FAKE_SUPABASE_LATENCY_MS=str(args.supabase_ms),
+        FAKE_GEMINI_LATENCY_MS=str(args.gemini_ms),
+        FAKE_SYLLABUS_WORDS=str(args.syllabus_words),
+        FAKE_SYLLABUS_COUNT=str(args.syllabus_count),
+        FAKE_GEMINI_ANSWER_WORDS=str(args.answer_words),
+        # Every request comes from the one bench user, so the per-user Gemini limit would dominate
+        LLM_USER_CONCURRENCY=str(args.concurrency),
+    )
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '-b', f"{HOST}:{args.port}", 'bench.fake_app:app'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_for_server(args.port)
+        cookie = login(args.port)
+
+        for n in range(args.warmup):
+            send(args.port, build(-1 - n, cookie, args), expected)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(lambda n: send(args.port, build(n, cookie, args), expected), range(args.requests)))
+        elapsed = time.perf_counter() - start
+
+        rss = [peak_rss_bytes(pid) for pid in worker_pids(server.pid)]
+        rss = [value for value in rss if value is not None]
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies = sorted(latency for _, latency in results)
+    return {
+        'ok': sum(1 for ok, _ in results if ok),
+        'requests': len(results),
+        'rps': len(results) / elapsed,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'peak_rss_mib': max(rss) / 1024 / 1024 if rss else None,
+    }
+
+
+def compare(name, result, baseline, tolerance):
+    # Latency and memory may grow and throughput may shrink by `tolerance` before it counts
+    problems = []
+    if result['ok'] < result['requests']:
+        problems.append(f"{result['requests'] - result['ok']} failed requests")
+    if not baseline:
+        return problems
+    for key in ('p50', 'p95', 'p99', 'peak_rss_mib'):
+        if result[key] is not None and baseline.get(key) and result[key] > baseline[key] * (1 + tolerance):
+            problems.append(f"{key} {result[key]:.3f} > baseline {baseline[key]:.3f}")
+    if baseline.get('rps') and result['rps'] < baseline['rps'] * (1 - tolerance):
+        problems.append(f"rps {result['rps']:.1f} < baseline {baseline['rps']:.1f}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--routes', default=','.join(ROUTES))
+    parser.add_argument('--worker-class', default=os.getenv('GUNICORN_WORKER_CLASS', 'gevent'))
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--supabase-ms', type=float, default=50)
+    parser.add_argument('--gemini-ms', type=float, default=1500)
+    parser.add_argument('--syllabus-words', type=int, default=3000)
+    parser.add_argument('--syllabus-count', type=int, default=6)
+    parser.add_argument('--answer-words', type=int, default=120)
+    parser.add_argument('--upload-kb', type=int, default=16)
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--baselines', default=BASELINES)
+    parser.add_argument('--save', action='store_true', help="write the results as the new baselines")
+    args = parser.parse_args()
+
+    saved = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            saved = json.load(f)
+    baselines = saved.get('routes', {})
+
+    results = {}
+    regressions = False
+    print(f"{'route':<14} {'ok':>9} {'req/s':>8} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'RSS MiB':>8}")
+    for name in args.routes.split(','):
+        result = run_route(name, args)
+        results[name] = result
+        rss = f"{result['peak_rss_mib']:>8.1f}" if result['peak_rss_mib'] is not None else f"{'n/a':>8}"
+        print(f"{name:<14} {result['ok']:>4}/{result['requests']:<4} {result['rps']:>8.1f} "
+              f"{result['p50']:>7.3f} {result['p95']:>7.3f} {result['p99']:>7.3f} {rss}")
+        for problem in compare(name, result, None if args.save else baselines.get(name), args.tolerance):
+            regressions = True
+            print(f"  REGRESSION {name}: {problem}")
+
+    if args.save:
+        settings = {key: value for key, value in vars(args).items() if key not in ('save', 'baselines', 'port', 'routes')}
+        with open(args.baselines, 'w') as f:
+            # Other benchmarks' entries (import_time) are kept as they are
+            json.dump({
+                **saved,
+                'machine': {'python': platform.python_version(), 'cpus': os.cpu_count()},
+                'settings': settings,
+                'routes': {**baselines, **results}
+            }, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Saved baselines to {args.baselines}")
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
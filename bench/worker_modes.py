@@ -0,0 +1,104 @@
+import argparse
+import http.client
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+
+# Compares gunicorn worker classes by serving bench.fake_app and sending
+# concurrent /chat requests. Supabase and Gemini latency come from the fakes.
+#
+#   python -m bench.worker_modes --workers 2 --concurrency 50 --requests 200
+
+HOST = '127.0.0.1'
+
+
+def wait_for_server(port, deadline=30):
+    start = time.time()
+    while time.time() - start < deadline:
+        try:
+            conn = http.client.HTTPConnection(HOST, port, timeout=2)
+            conn.request('GET', '/')
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("gunicorn did not start")
+
+
+def login(port):
+    conn = http.client.HTTPConnection(HOST, port, timeout=30)
+    body = urlencode({'email': 'bench@example.com', 'password': 'bench'})
+    conn.request('POST', '/login', body=body, headers={'Content-Type': 'application/x-www-form-urlencoded'})
+    response = conn.getresponse()
+    response.read()
+    return response.getheader('Set-Cookie').split(';', 1)[0]
+
+
+def chat_request(port, cookie, n):
+    # A different question each time, so the answer cache does not stand in for Gemini
+    start = time.perf_counter()
+    conn = http.client.HTTPConnection(HOST, port, timeout=300)
+    conn.request('POST', '/chat', body=json.dumps({'message': f"When is the late exam for week {n}?"}), headers={
+        'Content-Type': 'application/json',
+        'Cookie': cookie
+    })
+    response = conn.getresponse()
+    response.read()
+    return response.status, time.perf_counter() - start
+
+
+def run_mode(worker_class, args):
+    # Every request comes from the one bench user, so the per-user Gemini limit would dominate
+    env = dict(os.environ, GUNICORN_WORKER_CLASS=worker_class, WEB_CONCURRENCY=str(args.workers),
+               LLM_USER_CONCURRENCY=str(args.concurrency))
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '-b', f"{HOST}:{args.port}", 'bench.fake_app:app'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_for_server(args.port)
+        cookie = login(args.port)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(lambda n: chat_request(args.port, cookie, n), range(args.requests)))
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies = sorted(latency for _, latency in results)
+    return {
+        'worker_class': worker_class,
+        'ok': sum(1 for status, _ in results if status == 200),
+        'requests': len(results),
+        'rps': len(results) / elapsed,
+        'p50': statistics.median(latencies),
+        'p95': latencies[int(len(latencies) * 0.95) - 1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modes', default='sync,gevent')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    print(f"{'worker':<8} {'ok':>9} {'req/s':>8} {'p50 s':>7} {'p95 s':>7}")
+    for mode in args.modes.split(','):
+        result = run_mode(mode, args)
+        print(f"{result['worker_class']:<8} {result['ok']:>4}/{result['requests']:<4} "
+              f"{result['rps']:>8.1f} {result['p50']:>7.2f} {result['p95']:>7.2f}")
+
+
+if __name__ == '__main__':
+    main()
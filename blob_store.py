@@ -0,0 +1,197 @@
+import fcntl
+import hashlib
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+
+class BlobTooLarge(Exception):
+    pass
+
+
+class BlobStore:
+    """Content-addressed storage for uploaded files.
+
+    Each distinct file is stored once as ``root/ab/cd/<sha256>.<ext>`` next to a
+    ``.refs`` file counting the rows that point at it. Uploads are streamed to a
+    temporary file and hashed chunk by chunk, so memory use does not depend on
+    the file size. Reference counts are updated under an ``fcntl`` lock per
+    shard, which keeps them consistent across gunicorn workers on one host.
+    Blobs whose count drops to zero are removed by ``gc()``.
+    """
+
+    def __init__(self, root, max_bytes=50 * 1024 * 1024, chunk_size=1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.tmp_dir = os.path.join(root, 'tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+        self._legacy_hashes = {}
+        self._legacy_lock = threading.Lock()
+
+    def put(self, stream, extension):
+        """Store the contents of a file-like object and take a reference to it.
+
+        Returns ``(path, sha256, size)``. Raises ``BlobTooLarge`` once more
+        than ``max_bytes`` have been read; nothing is kept in that case.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        tmp_path = os.path.join(self.tmp_dir, uuid.uuid4().hex)
+        try:
+            with open(tmp_path, 'wb') as f:
+                while True:
+                    chunk = stream.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise BlobTooLarge(f"File is larger than {self.max_bytes // (1024 * 1024)} MB")
+                    digest.update(chunk)
+                    f.write(chunk)
+
+            sha = digest.hexdigest()
+            path = self.path_for(sha, extension)
+            with self._shard_lock(path):
+                if os.path.exists(path):
+                    os.remove(tmp_path)
+                else:
+                    os.replace(tmp_path, path)
+                self._write_refs(path, self._read_refs(path) + 1)
+            return path, sha, size
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def release(self, path):
+        """Drop one reference to ``path``.
+
+        Files saved before the blob store existed (flat ``uuid_name`` files in
+        the root) belong to a single row, so they are deleted right away.
+        """
+        if not path:
+            return
+        if not self.is_blob(path):
+            if os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.root) and os.path.isfile(path):
+                os.remove(path)
+            return
+        with self._shard_lock(path):
+            self._write_refs(path, max(0, self._read_refs(path) - 1))
+
+    def path_for(self, sha, extension):
+        shard = os.path.join(self.root, sha[:2], sha[2:4])
+        os.makedirs(shard, exist_ok=True)
+        return os.path.join(shard, f"{sha}.{extension.lower()}")
+
+    def is_blob(self, path):
+        parts = os.path.relpath(os.path.abspath(path), os.path.abspath(self.root)).split(os.sep)
+        return len(parts) == 3 and parts[2][:2] == parts[0] and parts[2][2:4] == parts[1]
+
+    def content_hash(self, path):
+        # Blobs are named after their hash; legacy files are hashed once per size and mtime
+        if self.is_blob(path):
+            return os.path.splitext(os.path.basename(path))[0]
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        with self._legacy_lock:
+            sha = self._legacy_hashes.get(key)
+        if sha is None:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                    digest.update(chunk)
+            sha = digest.hexdigest()
+            with self._legacy_lock:
+                self._legacy_hashes[key] = sha
+        return sha
+
+    def gc(self, grace_seconds=3600):
+        """Delete blobs nobody references and abandoned temporary files.
+
+        Only files untouched for ``grace_seconds`` are removed, so an upload
+        that has written its blob but not yet its database row is left alone.
+        """
+        cutoff = time.time() - grace_seconds
+        removed = freed = 0
+
+        for name in os.listdir(self.tmp_dir):
+            tmp_path = os.path.join(self.tmp_dir, name)
+            try:
+                if os.path.getmtime(tmp_path) < cutoff:
+                    freed += os.path.getsize(tmp_path)
+                    os.remove(tmp_path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+
+        for path in self._blob_paths():
+            with self._shard_lock(path):
+                try:
+                    if self._read_refs(path) > 0 or os.path.getmtime(self._refs_path(path)) >= cutoff:
+                        continue
+                except FileNotFoundError:
+                    # A blob without a refs file never finished its first put
+                    if os.path.getmtime(path) >= cutoff:
+                        continue
+                freed += os.path.getsize(path)
+                os.remove(path)
+                if os.path.exists(self._refs_path(path)):
+                    os.remove(self._refs_path(path))
+                removed += 1
+        return {'removed': removed, 'freed_bytes': freed}
+
+    def _blob_paths(self):
+        for first in os.listdir(self.root):
+            first_dir = os.path.join(self.root, first)
+            if len(first) != 2 or not os.path.isdir(first_dir):
+                continue
+            for second in os.listdir(first_dir):
+                shard = os.path.join(first_dir, second)
+                for name in os.listdir(shard):
+                    if not name.startswith('.') and not name.endswith(('.refs', '.tmp')):
+                        yield os.path.join(shard, name)
+
+    def _refs_path(self, path):
+        return path + '.refs'
+
+    def _read_refs(self, path):
+        try:
+            with open(self._refs_path(path)) as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _write_refs(self, path, count):
+        tmp_path = f"{self._refs_path(path)}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(str(count))
+        os.replace(tmp_path, self._refs_path(path))
+
+    @contextmanager
+    def _shard_lock(self, path):
+        with open(os.path.join(os.path.dirname(path), '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Remove unreferenced upload blobs")
+    parser.add_argument('command', choices=['gc'])
+    parser.add_argument('--root', default=os.getenv("UPLOAD_FOLDER", 'uploads'))
+    parser.add_argument('--grace', type=int, default=3600, help="seconds a file must be untouched before removal")
+    args = parser.parse_args()
+
+    result = BlobStore(args.root).gc(grace_seconds=args.grace)
+    print(f"Removed {result['removed']} files, freed {result['freed_bytes'] / 1024 / 1024:.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import base64
+import bisect
+import re
+import sys
+import zlib
+from array import array
+from itertools import accumulate
+
+from extraction import PAGE_BREAK
+
+
+FORMAT_PREFIX = 'c1:'
+LINE_START_RE = re.compile(r"[\n\f]")
+
+
+def _deltas(offsets):
+    return array('I', (b - a for a, b in zip([0] + offsets[:-1], offsets)))
+
+
+class CitationIndex:
+    """Page and line start offsets into a document's extracted text.
+
+    Built once at ingest and stored on the row in ``encode()``'d form (delta
+    encoded, compressed, about a byte per line), so mapping a character offset
+    to a page and line is two binary searches instead of a re-parse. Pages are
+    separated by ``PAGE_BREAK``; lines are counted from 1 on every page.
+    """
+
+    def __init__(self, page_starts, line_starts):
+        self.page_starts = page_starts
+        self.line_starts = line_starts
+
+    @classmethod
+    def from_text(cls, text):
+        page_starts = [0]
+        line_starts = [0]
+        for match in LINE_START_RE.finditer(text):
+            line_starts.append(match.end())
+            if match.group() == PAGE_BREAK:
+                page_starts.append(match.end())
+        return cls(page_starts, line_starts)
+
+    @classmethod
+    def decode(cls, data):
+        if not data or not data.startswith(FORMAT_PREFIX):
+            raise ValueError("Unknown citation index format")
+        payload = array('I')
+        payload.frombytes(zlib.decompress(base64.b64decode(data[len(FORMAT_PREFIX):])))
+        if sys.byteorder == 'big':
+            payload.byteswap()
+        page_count = payload[0]
+        page_starts = list(accumulate(payload[1:1 + page_count]))
+        line_starts = list(accumulate(payload[1 + page_count:]))
+        return cls(page_starts, line_starts)
+
+    def encode(self):
+        payload = array('I', [len(self.page_starts)]) + _deltas(self.page_starts) + _deltas(self.line_starts)
+        if sys.byteorder == 'big':
+            payload.byteswap()
+        return FORMAT_PREFIX + base64.b64encode(zlib.compress(payload.tobytes())).decode('ascii')
+
+    def locate(self, offset):
+        """Return the 1-based ``(page, line)`` containing character ``offset``."""
+        page = bisect.bisect_right(self.page_starts, offset)
+        line = bisect.bisect_right(self.line_starts, offset)
+        first_line_of_page = bisect.bisect_right(self.line_starts, self.page_starts[page - 1])
+        return page, line - first_line_of_page + 1
+
+    def cite(self, start, end):
+        page, line = self.locate(start)
+        end_page, end_line = self.locate(max(start, end - 1))
+        return {'page': page, 'line': line, 'end_page': end_page, 'end_line': end_line}
+
+
+def citation_index_for(row, text):
+    # Rows extracted before the index existed get one built from their text
+    try:
+        return CitationIndex.decode(row.get('citation_index'))
+    except (ValueError, zlib.error):
+        return CitationIndex.from_text(text)
@@ -0,0 +1,41 @@
+import os
+import threading
+
+
+class LazyClient:
+    """Stands in for an SDK client that is only imported and built on first use.
+
+    Attribute access is forwarded to the real client, which ``factory()``
+    creates the first time it is needed in each process. So importing the app
+    needs neither the SDKs nor live credentials, a ``--preload``ed master never
+    opens connections, and every forked worker builds its own client.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._client_pid = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._client is None or self._client_pid != os.getpid():
+                self._client = self._factory()
+                self._client_pid = os.getpid()
+            return self._client
+
+    def __getattr__(self, name):
+        # Only called for attributes not set in __init__
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+
+def supabase_client(url, key):
+    from supabase import create_client
+    return create_client(url, key)
+
+
+def gemini_client(api_key):
+    from google import genai
+    return genai.Client(api_key=api_key)
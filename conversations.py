@@ -0,0 +1,281 @@
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from prompt_builder import count_tokens, truncate_to_tokens
+from ttl_cache import TTLCache
+
+
+class Conversation:
+    """One chat thread: a bounded history plus the context its prompts are built on.
+
+    The context is a *base* block, assembled once and reused (and cached at
+    the provider) while it stays the same, plus *extra* passages picked up by
+    later questions, which are sent inline as the delta. Both are lists of
+    small item dicts with a ``key`` and their ``tokens``; the route maps them
+    back to text.
+    """
+
+    def __init__(self, conversation_id, user_id, scope):
+        self.id = conversation_id
+        self.user_id = user_id
+        self.scope = scope
+        self.turns = []
+        self.summary = []
+        self.base_key = None
+        self.base_items = []
+        self.extra_items = []
+        # Set when the client asked to continue a conversation that could not be found
+        self.history_dropped = False
+
+    def to_dict(self):
+        return {
+            'id': self.id, 'user_id': self.user_id, 'scope': self.scope,
+            'turns': self.turns, 'summary': self.summary,
+            'base_key': self.base_key, 'base_items': self.base_items, 'extra_items': self.extra_items
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        conversation = cls(data['id'], data['user_id'], data['scope'])
+        conversation.turns = [tuple(turn) for turn in data['turns']]
+        conversation.summary = data['summary']
+        conversation.base_key = data['base_key']
+        conversation.base_items = data['base_items']
+        conversation.extra_items = data['extra_items']
+        return conversation
+
+    @property
+    def is_follow_up(self):
+        return bool(self.turns or self.summary)
+
+    def history_text(self):
+        if not self.is_follow_up:
+            return ''
+        lines = ["Conversation so far:"]
+        if self.summary:
+            lines.append("Earlier: " + ' '.join(self.summary))
+        for question, answer in self.turns:
+            lines.append(f"Student: {question}")
+            lines.append(f"SylliAI: {answer}")
+        return '\n'.join(lines)
+
+    def reset_context(self):
+        # The documents behind the context changed; the next turn starts a new base
+        self.base_key = None
+        self.base_items = []
+        self.extra_items = []
+
+    def plan_context(self, selected, base_key, extra_budget):
+        """Fold this turn's passages into the context and return ``(base_items, extra_items)``.
+
+        ``selected`` are this turn's passages, most relevant first, and
+        ``base_key`` fingerprints them as a block. The first turn makes them
+        the base. Later turns keep the base and add only passages it lacks, until
+        those exceed ``extra_budget`` tokens; then this turn's passages become
+        the new base.
+        """
+        if self.base_key is not None:
+            known = {item['key'] for item in self.base_items + self.extra_items}
+            extra = self.extra_items + [item for item in selected if item['key'] not in known]
+            if sum(item['tokens'] for item in extra) <= extra_budget:
+                self.extra_items = extra
+                return self.base_items, self.extra_items
+        self.base_key = base_key
+        self.base_items = list(selected)
+        self.extra_items = []
+        return self.base_items, self.extra_items
+
+
+class ConversationStore:
+    """Conversations, dropped after ``ttl`` seconds of inactivity.
+
+    Each keeps its last ``max_turns`` exchanges word for word, each side cut to
+    ``turn_tokens``. Older exchanges are folded into a summary of their
+    question and the first sentence of their answer, itself capped at
+    ``summary_tokens`` by forgetting the oldest. So a prompt's history stays
+    bounded however long the chat runs.
+
+    Conversations live in process memory by default, so a follow-up only
+    finds its history on the worker that served the earlier turns. When
+    ``redis_url`` is set (and the optional ``redis`` package is installed)
+    they are kept in Redis, like ``MetadataCache`` entries, and every worker
+    sees them.
+    """
+
+    def __init__(self, max_turns=4, turn_tokens=300, summary_tokens=600, ttl=3600, maxsize=1000, redis_url=None):
+        self.max_turns = max_turns
+        self.turn_tokens = turn_tokens
+        self.summary_tokens = summary_tokens
+        self.ttl = ttl
+        self._conversations = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._redis = None
+
+        if redis_url:
+            try:
+                import redis
+                self._redis = redis.Redis.from_url(redis_url)
+            except ImportError:
+                print("REDIS_URL is set but the redis package is not installed; keeping conversations in process")
+
+    def get_or_create(self, user_id, scope, conversation_id=None):
+        # An unknown, expired or someone else's id starts a new conversation flagged ``history_dropped``
+        if conversation_id:
+            conversation = self._load(conversation_id)
+            if conversation is not None and conversation.user_id == user_id and conversation.scope == scope:
+                conversation.history_dropped = False
+                return conversation
+        conversation = Conversation(uuid.uuid4().hex, user_id, scope)
+        conversation.history_dropped = bool(conversation_id)
+        if self._redis is None:
+            self._conversations.set(conversation.id, conversation, tags=[f"user:{user_id}"])
+        return conversation
+
+    def add_turn(self, conversation, question, answer):
+        question = truncate_to_tokens(question or '', self.turn_tokens)
+        answer = truncate_to_tokens(answer or '', self.turn_tokens)
+        with self._lock:
+            conversation.turns.append((question, answer))
+            while len(conversation.turns) > self.max_turns:
+                old_question, old_answer = conversation.turns.pop(0)
+                first_sentence = old_answer.split('. ', 1)[0].strip()
+                conversation.summary.append(f"Asked \"{truncate_to_tokens(old_question, 40)}\"; "
+                                            f"answered \"{truncate_to_tokens(first_sentence, 60)}\".")
+            while conversation.summary and count_tokens(' '.join(conversation.summary)) > self.summary_tokens:
+                conversation.summary.pop(0)
+        # Re-store so the conversation's inactivity timer restarts; this also saves its context
+        self._save(conversation)
+
+    def invalidate_user(self, user_id):
+        if self._redis is not None:
+            try:
+                user_key = self._redis_user_key(user_id)
+                ids = self._redis.smembers(user_key)
+                self._redis.delete(user_key, *[self._redis_key(conversation_id.decode()) for conversation_id in ids])
+            except Exception as e:
+                print(f"Error dropping conversations for {user_id}: {str(e)}")
+            return
+        self._conversations.invalidate_tag(f"user:{user_id}")
+
+    def _redis_key(self, conversation_id):
+        return f"sylliai:conversation:{conversation_id}"
+
+    def _redis_user_key(self, user_id):
+        return f"sylliai:conversations:{user_id}"
+
+    def _load(self, conversation_id):
+        if self._redis is None:
+            return self._conversations.get(conversation_id)
+        try:
+            stored = self._redis.get(self._redis_key(conversation_id))
+        except Exception as e:
+            # Without Redis the chat still answers, just without its history
+            print(f"Error reading conversation: {str(e)}")
+            return None
+        return Conversation.from_dict(json.loads(stored)) if stored is not None else None
+
+    def _save(self, conversation):
+        if self._redis is None:
+            self._conversations.set(conversation.id, conversation, tags=[f"user:{conversation.user_id}"])
+            return
+        try:
+            user_key = self._redis_user_key(conversation.user_id)
+            pipeline = self._redis.pipeline()
+            pipeline.set(self._redis_key(conversation.id), json.dumps(conversation.to_dict()), ex=self.ttl)
+            pipeline.sadd(user_key, conversation.id)
+            pipeline.expire(user_key, self.ttl)
+            pipeline.execute()
+        except Exception as e:
+            print(f"Error writing conversation: {str(e)}")
+
+
+class ContextCaches:
+    """Provider-side caches of context blocks (Gemini cached content).
+
+    A block cached here is referenced by name instead of being sent again, so
+    follow-up turns only send the history, the delta and the question. Blocks
+    under ``min_tokens`` are never cached (the API has a minimum and small
+    blocks are cheap to resend). If creating a cache fails, for example
+    because the model does not support caching, caching is switched off for
+    ``disable_seconds``.
+
+    ``client`` is a callable returning the genai client, so a stub can be
+    swapped in (tests, benchmarks) after this is created.
+    """
+
+    def __init__(self, client, model, min_tokens=4096, ttl_seconds=600, maxsize=64, disable_seconds=600):
+        self.client = client
+        self.model = model
+        self.min_tokens = min_tokens
+        self.ttl_seconds = ttl_seconds
+        self.maxsize = maxsize
+        self.disable_seconds = disable_seconds
+
+        self._names = OrderedDict()
+        self._creating = set()
+        self._disabled_until = 0.0
+        self._lock = threading.Lock()
+
+        self.created = 0
+        self.reused = 0
+
+    def get(self, key, system_instruction, context, tokens):
+        """Return the cached-content name for a block, creating it if needed, or ``None``."""
+        if tokens < self.min_tokens:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            if now < self._disabled_until:
+                return None
+            entry = self._names.get(key)
+            # Leave a margin so a cache never expires between lookup and use
+            if entry is not None and entry[1] - 30 > now:
+                self._names.move_to_end(key)
+                self.reused += 1
+                return entry[0]
+            if key in self._creating:
+                return None
+            self._creating.add(key)
+
+        try:
+            cache = self.client().caches.create(model=self.model, contents=[context], config={
+                'system_instruction': system_instruction,
+                'ttl': f"{self.ttl_seconds}s"
+            })
+        except Exception as e:
+            print(f"Error creating context cache: {str(e)}")  # For debugging
+            with self._lock:
+                self._creating.discard(key)
+                self._disabled_until = time.monotonic() + self.disable_seconds
+            return None
+
+        evicted = []
+        with self._lock:
+            self._creating.discard(key)
+            self._names[key] = (cache.name, now + self.ttl_seconds)
+            self.created += 1
+            while len(self._names) > self.maxsize:
+                evicted.append(self._names.popitem(last=False)[1][0])
+        for name in evicted:
+            self._delete(name)
+        return cache.name
+
+    def forget(self, key):
+        # Called when a cache turned out to be unusable; the next turn creates a fresh one
+        with self._lock:
+            entry = self._names.pop(key, None)
+        if entry is not None:
+            self._delete(entry[0])
+
+    def stats(self):
+        with self._lock:
+            return {'created': self.created, 'reused': self.reused, 'entries': len(self._names)}
+
+    def _delete(self, name):
+        try:
+            self.client().caches.delete(name=name)
+        except Exception as e:
+            print(f"Error deleting context cache {name}: {str(e)}")  # For debugging
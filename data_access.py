@@ -0,0 +1,116 @@
+import time
+
+
+# Column-projected queries for the syllabi and documents tables. Listing and
+# ownership checks never pull the content/extracted_text blobs, so their cost
+# stays flat however large the pasted syllabi get.
+
+SYLLABUS_LIST_COLUMNS = 'id,course_name,content_type,created_at'
+SYLLABUS_DETAIL_COLUMNS = 'id,user_id,course_name,content,content_type,file_path,extraction_status,faq,created_at'
+SYLLABUS_TEXT_COLUMNS = 'id,user_id,course_name,content_type,file_path,extraction_status,extracted_text,citation_index,term_index,facts,faq'
+DOCUMENT_TEXT_COLUMNS = 'id,syllabus_id,name,document_type,content_type,content,file_path,extraction_status,extracted_text,citation_index,term_index'
+SYLLABUS_FILE_COLUMNS = 'id,user_id,content_type,file_path'
+FACT_DATE_COLUMNS = 'syllabus_id,kind,label,due_date,date_text'
+
+
+def list_syllabi(db, user_id, limit=None, cursor=None, columns=SYLLABUS_LIST_COLUMNS):
+    """Return ``(rows, next_cursor)`` for a user's syllabi, newest first.
+
+    Pages are keyed on ``(created_at, id)`` rather than offsets, so a page
+    costs the same however deep into the list it is, and rows inserted in one
+    batch with the same timestamp are not skipped at a page boundary.
+    ``next_cursor`` is ``None`` on the last page.
+    """
+    query = (db.table('syllabi').select(columns).eq('user_id', user_id)
+             .order('created_at', desc=True).order('id', desc=True))
+    if cursor:
+        created_at, _, last_id = cursor.partition('|')
+        if last_id:
+            query = query.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt."{last_id}")')
+        else:
+            # Links from before cursors carried the id
+            query = query.lt('created_at', created_at)
+    if limit is None:
+        return query.execute().data, None
+
+    # One extra row tells us whether another page exists
+    rows = query.limit(limit + 1).execute().data
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, f"{rows[-1]['created_at']}|{rows[-1]['id']}"
+    return rows, None
+
+
+def get_syllabus(db, syllabus_id, columns=SYLLABUS_DETAIL_COLUMNS, user_id=None):
+    query = db.table('syllabi').select(columns).eq('id', syllabus_id)
+    if user_id is not None:
+        query = query.eq('user_id', user_id)
+    rows = query.limit(1).execute().data
+    return rows[0] if rows else None
+
+
+def get_document(db, document_id, user_id, columns='id,syllabus_id'):
+    rows = db.table('documents').select(columns).eq('id', document_id).eq('user_id', user_id).limit(1).execute().data
+    return rows[0] if rows else None
+
+
+def list_document_files(db, syllabus_id, user_id):
+    rows = db.table('documents').select('file_path').eq('syllabus_id', syllabus_id).eq('user_id', user_id).execute().data
+    return [row['file_path'] for row in rows if row.get('file_path')]
+
+
+def list_documents(db, syllabus_id, user_id, columns=DOCUMENT_TEXT_COLUMNS):
+    return db.table('documents').select(columns).eq('syllabus_id', syllabus_id).eq('user_id', user_id).execute().data
+
+
+def list_user_documents(db, user_id, columns=DOCUMENT_TEXT_COLUMNS):
+    return db.table('documents').select(columns).eq('user_id', user_id).execute().data
+
+
+def insert_facts(db, rows):
+    # For a syllabus that was just created and so has no facts to replace
+    if rows:
+        db.table('syllabus_facts').insert(rows).execute()
+
+
+def replace_facts(db, syllabus_id, rows):
+    # Facts are always rewritten as a set, so a re-extracted syllabus never keeps stale dates
+    db.table('syllabus_facts').delete().eq('syllabus_id', syllabus_id).execute()
+    insert_facts(db, rows)
+
+
+def list_fact_dates(db, user_id, since=None, limit=None):
+    """Return a user's dated exam and assignment facts, soonest first."""
+    query = (db.table('syllabus_facts').select(FACT_DATE_COLUMNS).eq('user_id', user_id)
+             .in_('kind', ['exam', 'assignment']).order('due_date'))
+    if since is not None:
+        query = query.gte('due_date', since)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.execute().data
+
+
+def claim_faq(db, syllabus_id, claim, expire_seconds):
+    """Mark a syllabus's FAQ for ``claim`` as taken; returns ``False`` if another worker already has it.
+
+    The conditional update is atomic, so of several workers queueing the same
+    text only one generates it. A claim holds until it is released with the
+    stored FAQ, or for ``expire_seconds`` if its job never stores one.
+    """
+    now = time.time()
+    claimed_at = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(now))
+    expired_before = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(now - expire_seconds))
+    rows = (db.table('syllabi').update({'faq_claim': claim, 'faq_claimed_at': claimed_at}).eq('id', syllabus_id)
+            .or_(f'faq_claim.is.null,faq_claim.neq."{claim}",faq_claimed_at.lt."{expired_before}"').execute().data)
+    return bool(rows)
+
+
+def store_faq(db, syllabus_id, faq):
+    # Clearing the claim time keeps the claim for good: this text's FAQ is done
+    db.table('syllabi').update({'faq': faq, 'faq_claimed_at': None}).eq('id', syllabus_id).execute()
+
+
+def list_syllabi_without_facts(db, user_id, version):
+    # Rows that have text but were ingested before facts were extracted, or by an older extractor
+    return (db.table('syllabi').select('id').eq('user_id', user_id).eq('extraction_status', 'ready')
+            .or_(f"facts.is.null,facts->>version.neq.{version}").execute().data)
@@ -0,0 +1,118 @@
+import os
+import re
+
+# The parsers (pypdf, pdfplumber, python-docx) are imported inside the functions that use
+# them: they are slow to import and only the ingest pool processes ever need them
+
+
+# Separates pages in extracted PDF text so page boundaries survive storage
+PAGE_BREAK = '\f'
+
+
+# Limits that keep a single huge upload from exhausting a worker
+MAX_PAGES = 500
+MAX_FILE_BYTES = 50 * 1024 * 1024
+MAX_TEXT_BYTES = 5 * 1024 * 1024
+
+# Lines this long usually mean pypdf merged columns or table cells
+MAX_FAST_LINE_CHARS = 400
+
+
+class ExtractionLimitError(Exception):
+    pass
+
+
+def _needs_layout(text):
+    # Decide whether pypdf's text layer is good enough or pdfplumber should redo the page
+    if not text.strip():
+        return True
+    if '(cid:' in text:
+        return True
+    return any(len(line) > MAX_FAST_LINE_CHARS for line in text.split('\n'))
+
+
+def count_pdf_pages(file_path):
+    # Reads only the page tree, not page content
+    from pypdf import PdfReader
+    return len(PdfReader(file_path).pages)
+
+
+def iter_pdf_pages(file_path, max_pages=MAX_PAGES, first_page=0, last_page=None):
+    """Yield the text of each page in a PDF, one page at a time.
+
+    pypdf's text layer is tried first since it is several times faster than
+    pdfplumber. pdfplumber is only opened for pages that come back empty or
+    garbled, and each page's parsed objects are released before the next one is
+    read so memory stays flat on long course packs. ``first_page`` and
+    ``last_page`` (exclusive) select a slice so large files can be split across
+    workers.
+    """
+    from pypdf import PdfReader
+    reader = PdfReader(file_path)
+    stop = min(len(reader.pages), max_pages, last_page if last_page is not None else max_pages)
+    plumber = None
+    try:
+        for page_number in range(first_page, stop):
+            text = reader.pages[page_number].extract_text() or ''
+
+            if _needs_layout(text):
+                if plumber is None:
+                    import pdfplumber
+                    plumber = pdfplumber.open(file_path)
+                layout_page = plumber.pages[page_number]
+                text = layout_page.extract_text() or text
+                layout_page.flush_cache()
+
+            yield text.strip()
+    finally:
+        if plumber is not None:
+            plumber.close()
+
+
+def iter_pages(file_path, max_pages=MAX_PAGES, max_bytes=MAX_FILE_BYTES, page_range=None):
+    if os.path.getsize(file_path) > max_bytes:
+        raise ExtractionLimitError(f"{file_path} is larger than {max_bytes} bytes")
+
+    lower_path = file_path.lower()
+    if lower_path.endswith('.pdf'):
+        first_page, last_page = page_range or (0, None)
+        yield from iter_pdf_pages(file_path, max_pages=max_pages, first_page=first_page, last_page=last_page)
+    elif lower_path.endswith('.docx'):
+        from docx import Document
+        doc = Document(file_path)
+        yield '\n'.join(para.text for para in doc.paragraphs).strip()
+    elif lower_path.endswith('.txt'):
+        with open(file_path, 'r') as file:
+            yield file.read().strip()
+    else:
+        raise ExtractionLimitError(f"Unsupported file type: {file_path}")
+
+
+def extract_text_from_file(file_path, max_pages=MAX_PAGES, max_bytes=MAX_FILE_BYTES, max_text_bytes=MAX_TEXT_BYTES, page_range=None):
+    try:
+        pages = []
+        text_bytes = 0
+        for text in iter_pages(file_path, max_pages=max_pages, max_bytes=max_bytes, page_range=page_range):
+            text_bytes += len(text.encode('utf-8'))
+            if text_bytes > max_text_bytes:
+                # Keep what fits rather than failing the whole document
+                print(f"Stopping extraction of {file_path} after {len(pages)} pages: text limit reached")
+                break
+            pages.append(text)
+        return PAGE_BREAK.join(pages)
+    except Exception as e:
+        print(f"Error reading file {file_path}: {str(e)}")
+        return None
+
+
+def normalize_text(text):
+    text = text.replace('\r\n', '\n').replace('\r', '\n').replace('\x00', '')
+    pages = []
+    for page in text.split(PAGE_BREAK):
+        # Collapse runs of spaces/tabs and blank lines left behind by PDF layout
+        page = re.sub(r'[ \t\u00a0]+', ' ', page)
+        page = re.sub(r' *\n *', '\n', page)
+        page = re.sub(r'\n{3,}', '\n\n', page)
+        pages.append(page.strip())
+    # Empty pages are kept so page numbers still line up with the original file
+    return PAGE_BREAK.join(pages)
@@ -0,0 +1,166 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+# Bump this whenever the extraction logic changes so stale text is never served
+EXTRACTOR_VERSION = '3'
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class ExtractionCache:
+    """Two-tier cache of extracted document text keyed by content hash.
+
+    The memory tier is a per-process LRU bounded by the total size of the cached
+    text. The disk tier lives in a directory shared by every gunicorn worker and
+    is trimmed oldest-first once it grows past ``max_disk_bytes``. The cache
+    lives in the ingest pool processes, so it keeps no hit counts of its own;
+    each lookup reports which tier answered it and the caller counts them.
+    """
+
+    def __init__(self, cache_dir, max_memory_bytes=32 * 1024 * 1024, max_disk_bytes=512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = None
+        # (path, mtime, size) -> content hash, so unchanged files are not re-read
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get_or_extract(self, file_path, extract, version=EXTRACTOR_VERSION):
+        """Return ``(text, tier)``, where ``tier`` is ``'memory'`` or ``'disk'`` for a hit and ``None`` for a miss."""
+        key = self.key_for(file_path, version)
+
+        text = self._memory_get(key)
+        if text is not None:
+            return text, 'memory'
+
+        text = self._disk_get(key)
+        if text is not None:
+            self._memory_put(key, text)
+            return text, 'disk'
+
+        text = extract(file_path)
+        # Failed extractions are not cached so a fixed file gets retried
+        if text is not None:
+            self._memory_put(key, text)
+            self._disk_put(key, text)
+        return text, None
+
+    def key_for(self, file_path, version=EXTRACTOR_VERSION):
+        stat = os.stat(file_path)
+        memo_key = (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            digest = self._hashes.get(memo_key)
+
+        if digest is None:
+            sha = hashlib.sha256()
+            with open(file_path, 'rb') as f:
+                for block in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                    sha.update(block)
+            digest = sha.hexdigest()
+            with self._lock:
+                self._hashes[memo_key] = digest
+
+        return f"{digest}-v{version}"
+
+    def _memory_get(self, key):
+        with self._lock:
+            text = self._memory.get(key)
+            if text is not None:
+                self._memory.move_to_end(key)
+            return text
+
+    def _memory_put(self, key, text):
+        size = len(text.encode('utf-8'))
+        if size > self.max_memory_bytes:
+            return
+
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return
+            self._memory[key] = text
+            self._memory_bytes += size
+            while self._memory_bytes > self.max_memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted.encode('utf-8'))
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.txt")
+
+    def _disk_get(self, key):
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            print(f"Error reading extraction cache entry {path}: {str(e)}")
+            return None
+
+        # Refresh the timestamp so eviction drops the least recently used entries
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return text
+
+    def _disk_put(self, key, text):
+        path = self._disk_path(key)
+        directory = os.path.dirname(path)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            # Write to a temp file and rename so other workers never see partial entries
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error writing extraction cache entry {path}: {str(e)}")
+            return
+
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes += os.path.getsize(path)
+            over_limit = self._disk_bytes is None or self._disk_bytes > self.max_disk_bytes
+
+        if over_limit:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # Another worker may have evicted it first
+                continue
+            total -= size
+
+        with self._lock:
+            self._disk_bytes = total
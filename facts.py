@@ -0,0 +1,287 @@
+import json
+import re
+from collections import Counter
+from datetime import date
+
+from retrieval import tokenize
+from term_index import extract_terms, stem
+
+
+# Bump when the extractor changes; rows with older facts are re-extracted from their text when read
+FACTS_VERSION = 2
+
+MAX_LABEL_CHARS = 120
+MAX_POLICY_CHARS = 600
+MAX_DATES = 200
+
+MONTHS = {
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12
+}
+MONTH_DATE_RE = re.compile(
+    r"\b(?P<month>jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?|"
+    r"sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)\.?\s+(?P<day>\d{1,2})(?:st|nd|rd|th)?\b"
+    r"(?:,?\s+(?P<year>\d{4})\b)?",
+    re.IGNORECASE
+)
+NUMERIC_DATE_RE = re.compile(r"\b(?P<month>\d{1,2})/(?P<day>\d{1,2})(?:/(?P<year>\d{4}|\d{2}))?\b")
+ISO_DATE_RE = re.compile(r"\b(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2})\b")
+YEAR_RE = re.compile(r"\b(20\d{2})\b")
+
+# Exam nouns only: "final" or "test" alone is as likely to be prose ("scores are final")
+EXAM_RE = re.compile(r"\b(?:exam(?:ination)?s?|midterms?|quiz(?:zes)?)\b", re.IGNORECASE)
+ASSIGNMENT_RE = re.compile(r"\b(?:assignment|homework|hw|project|paper|essay|lab|report|presentation|due)\b", re.IGNORECASE)
+
+# "Midterm Exam ..... 25%", "Homework: 20 percent", "Final (30%)"
+WEIGHT_RE = re.compile(
+    r"^\s*(?:[-*•]\s*)?(?P<label>[A-Za-z][A-Za-z0-9 &/,'+-]{1,60}?)(?:\s*\([^)]*\))?"
+    r"[\s:.\-–—]*\(?\s*(?P<weight>\d{1,3}(?:\.\d+)?)\s*(?:%|percent)\)?\s*$",
+    re.IGNORECASE
+)
+LETTER_GRADE_RE = re.compile(r"^[A-F][+-]?(?:\s|$)")
+ATTENDANCE_RE = re.compile(r"\b(?:attendance|absen(?:ce|ces|t))\b", re.IGNORECASE)
+
+
+def _clean(text, limit):
+    # PDF icon fonts leave private-use glyphs behind; they and control characters are dropped
+    text = ''.join(ch if ch.isprintable() else ' ' for ch in text)
+    text = re.sub(r"\s+", ' ', text).strip(' \t:-–—|')
+    return text[:limit].rstrip()
+
+
+def _grading(lines):
+    # Weight lines that sit together and add up to about 100% are the grade breakdown;
+    # a lone "late work loses 10%" or a letter-grade scale is not
+    candidates = []
+    for i, line in enumerate(lines):
+        match = WEIGHT_RE.match(line)
+        if match and not LETTER_GRADE_RE.match(match.group('label').strip()):
+            weight = float(match.group('weight'))
+            if 0 < weight <= 100:
+                candidates.append((i, _clean(match.group('label'), MAX_LABEL_CHARS), weight))
+
+    groups = []
+    for candidate in candidates:
+        if groups and candidate[0] - groups[-1][-1][0] <= 2:
+            groups[-1].append(candidate)
+        else:
+            groups.append([candidate])
+
+    best = None
+    for group in groups:
+        total = sum(weight for _, _, weight in group)
+        if len(group) >= 2 and 90 <= total <= 110 and (best is None or abs(total - 100) < abs(best[0] - 100)):
+            best = (total, group)
+    if best is None:
+        return []
+    return [{'label': label, 'weight': weight} for _, label, weight in best[1]]
+
+
+def _attendance(lines):
+    for i, line in enumerate(lines):
+        if not ATTENDANCE_RE.search(line):
+            continue
+        stripped = line.strip()
+        if len(stripped) < 40 and not stripped.endswith('.'):
+            # A heading: the policy is the paragraph under it
+            body = []
+            for following in lines[i + 1:]:
+                if not following.strip():
+                    if body:
+                        break
+                    continue
+                body.append(following.strip())
+                if sum(len(part) for part in body) >= MAX_POLICY_CHARS:
+                    break
+            if body:
+                return _clean(' '.join(body), MAX_POLICY_CHARS)
+            continue
+        # Inline: the sentences from the one that mentions attendance onwards
+        match = ATTENDANCE_RE.search(stripped)
+        start = stripped.rfind('. ', 0, match.start())
+        return _clean(stripped[start + 2 if start >= 0 else 0:], MAX_POLICY_CHARS)
+    return None
+
+
+def _default_year(text):
+    years = Counter(YEAR_RE.findall(text))
+    return int(years.most_common(1)[0][0]) if years else None
+
+
+def _parse_date(match, default_year, fall_term):
+    month = match.group('month')
+    month = int(month) if month.isdigit() else MONTHS[month[:3].lower()]
+    day = int(match.group('day'))
+    year = match.group('year')
+    if year:
+        year = int(year)
+        if year < 100:
+            year += 2000
+    elif default_year:
+        # A fall syllabus's January/February dates fall in the following year
+        year = default_year + 1 if fall_term and month <= 2 else default_year
+    if year is None:
+        return None
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+def _dates(lines, default_year, fall_term):
+    found = []
+    seen = set()
+    for line in lines:
+        kind = 'exam' if EXAM_RE.search(line) else 'assignment' if ASSIGNMENT_RE.search(line) else None
+        if kind is None or len(line.strip()) > MAX_LABEL_CHARS:
+            # Schedule entries are short; a long line is a sentence that happens to mention a date
+            continue
+        for pattern in (ISO_DATE_RE, MONTH_DATE_RE, NUMERIC_DATE_RE):
+            match = pattern.search(line)
+            if match:
+                break
+        else:
+            continue
+        due = _parse_date(match, default_year, fall_term)
+        if due is None and pattern is not MONTH_DATE_RE:
+            # A numeric match that is not a valid date is more likely a score or a fraction
+            continue
+        label = _clean(line[:match.start()] + ' ' + line[match.end():], MAX_LABEL_CHARS) or kind.title()
+        key = (label.lower(), due, match.group(0).lower())
+        if key in seen:
+            continue
+        seen.add(key)
+        found.append({
+            'kind': kind,
+            'label': label,
+            'date': due.isoformat() if due else None,
+            'date_text': match.group(0)
+        })
+        if len(found) >= MAX_DATES:
+            break
+    return found
+
+
+def extract_facts(text):
+    """Pull grading weights, the attendance policy and exam/assignment dates out of syllabus text.
+
+    Runs once at ingest; the result is stored on the syllabus row and, one row
+    per fact, in ``syllabus_facts``. Anything the heuristics cannot find is left
+    out rather than guessed, so chat falls back to Gemini for it.
+    """
+    lines = text.splitlines()
+    return {
+        'version': FACTS_VERSION,
+        'grading': _grading(lines),
+        'attendance': _attendance(lines),
+        'dates': _dates(lines, _default_year(text), re.search(r"\bfall\b", text, re.IGNORECASE) is not None)
+    }
+
+
+def row_facts(row, text):
+    # Rows ingested before facts existed, or by an older extractor, get them from the text
+    stored = row.get('facts')
+    if isinstance(stored, str):
+        stored = json.loads(stored)
+    if stored and stored.get('version') == FACTS_VERSION:
+        return stored
+    return extract_facts(text or '')
+
+
+def fact_rows(syllabus_id, user_id, facts):
+    """Rows for the ``syllabus_facts`` table."""
+    rows = [{
+        'syllabus_id': syllabus_id, 'user_id': user_id, 'kind': 'grading',
+        'label': item['label'], 'weight': item['weight']
+    } for item in facts['grading']]
+    if facts['attendance']:
+        rows.append({
+            'syllabus_id': syllabus_id, 'user_id': user_id, 'kind': 'attendance',
+            'label': 'Attendance policy', 'details': facts['attendance']
+        })
+    rows.extend({
+        'syllabus_id': syllabus_id, 'user_id': user_id, 'kind': item['kind'],
+        'label': item['label'], 'due_date': item['date'], 'date_text': item['date_text']
+    } for item in facts['dates'])
+    return rows
+
+
+def format_date(value, fallback=''):
+    if not value:
+        return fallback
+    day = date.fromisoformat(value)
+    return f"{day:%a %b} {day.day}, {day.year}"
+
+
+GRADING_WORDS = {'weight', 'weights', 'weighted', 'worth', 'percent', 'percentage', 'breakdown', 'distribution'}
+GRADE_WORDS = {'grade', 'grades', 'grading'}
+GRADE_HOW_WORDS = {'calculated', 'determined', 'computed', 'work', 'works', 'split'}
+ATTENDANCE_WORDS = {'attendance', 'attend', 'absence', 'absences', 'absent'}
+DATE_WORDS = {'when', 'date', 'dates', 'due', 'deadline', 'deadlines', 'calendar', 'schedule', 'scheduled'}
+QUESTION_NOISE = {stem(word) for word in GRADING_WORDS | GRADE_WORDS | GRADE_HOW_WORDS | DATE_WORDS} | {'policy', 'class', 'course'}
+
+
+def _best_matches(items, wanted):
+    # Items whose label shares the most terms with the question
+    scored = [(len(extract_terms(item['label']) & wanted), item) for item in items]
+    best = max((score for score, _ in scored), default=0)
+    return [item for score, item in scored if score and score == best]
+
+
+def _strong_matches(items, wanted):
+    # Items whose label contains every term of the question; anything looser is left to Gemini
+    return [item for item in items if wanted <= extract_terms(item['label'])]
+
+
+def answer_from_facts(question, courses):
+    """Answer common grading, attendance and date questions without calling Gemini.
+
+    ``courses`` is a list of ``(syllabus_id, course_name, facts)``. Returns
+    ``(text, syllabus_ids)``, or ``None`` when the question is not one the
+    facts can answer, in which case the caller asks Gemini as usual.
+    """
+    words = set(tokenize(question or ''))
+    wants_grading = bool(words & GRADING_WORDS) or (bool(words & GRADE_WORDS) and bool(words & GRADE_HOW_WORDS))
+    wants_attendance = bool(words & ATTENDANCE_WORDS)
+    wants_dates = bool(words & DATE_WORDS) and not wants_grading
+    if not (wants_grading or wants_attendance or wants_dates):
+        return None
+
+    terms = extract_terms(question) - QUESTION_NOISE
+    # A question naming some of the courses is only about those
+    named = [course for course in courses if extract_terms(course[1]) & terms]
+    if named:
+        courses = named
+        terms -= set().union(*(extract_terms(course[1]) for course in named))
+
+    sections = []
+    used = []
+    answered = set()
+    for syllabus_id, course_name, facts in courses:
+        parts = []
+        if wants_grading and facts['grading']:
+            answered.add('grading')
+            items = _best_matches(facts['grading'], terms) or facts['grading']
+            parts.append("Grade breakdown:\n" + '\n'.join(f"- {item['label']}: {item['weight']:g}%" for item in items))
+        if wants_attendance and facts['attendance']:
+            answered.add('attendance')
+            parts.append(f"Attendance policy: {facts['attendance']}")
+        if wants_dates and facts['dates']:
+            wanted = terms - {stem(word) for word in ATTENDANCE_WORDS}
+            items = sorted(_strong_matches(facts['dates'], wanted) if wanted else facts['dates'],
+                           key=lambda item: item['date'] or '9999')
+            if items:
+                answered.add('dates')
+                parts.append("Dates:\n" + '\n'.join(
+                    f"- {item['label']}: {format_date(item['date'], item['date_text'])}" for item in items))
+        if parts:
+            sections.append(f"{course_name}\n" + '\n\n'.join(parts))
+            used.append(syllabus_id)
+
+    # Half an answer is worse than Gemini's full one
+    wanted = {'grading'} if wants_grading else set()
+    wanted |= {'attendance'} if wants_attendance else set()
+    wanted |= {'dates'} if wants_dates else set()
+    if not sections or answered != wanted:
+        return None
+    return '\n\n'.join(sections), used
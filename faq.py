@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from prompt_builder import PromptBuilder
+from term_index import extract_terms, stem
+
+
+# Bump when the questions or the prompt change; older stored answers are then regenerated
+FAQ_VERSION = 1
+
+
+def _stems(words):
+    return frozenset(stem(word) for word in words.split())
+
+
+# (key, question, any of these must be asked about, every other question term must be one of these)
+FAQ_QUESTIONS = (
+    ('late_policy', "What is the late work policy?",
+     _stems("late extension extensions"),
+     _stems("late work policy submission submissions submit assignment assignments homework penalty penalties "
+            "extension extensions deadline deadlines accept accepted turn turning rule rules")),
+    ('office_hours', "When and where are office hours?",
+     _stems("office"),
+     _stems("office hours location held instructor professor ta tas meet")),
+    ('exam_dates', "When are the exams?",
+     _stems("exam exams midterm midterms final finals"),
+     _stems("exam exams midterm midterms final finals date dates schedule scheduled held test tests")),
+    ('grading', "How is the final grade calculated?",
+     _stems("grade grades grading weights"),
+     _stems("grade grades grading final calculated determined computed weights weighted breakdown distribution "
+            "percent percentage")),
+)
+
+UNKNOWN_ANSWER = "The syllabus does not say."
+JSON_BLOCK_RE = re.compile(r"\{.*\}", re.DOTALL)
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def build_prompt(course_name, context):
+    questions = '\n'.join(f'"{key}": {question}' for key, question, _, _ in FAQ_QUESTIONS)
+    return f"""You are SylliAI, an AI assistant specialized in analyzing course syllabi.
+    Answer each of these common student questions about {course_name} using only the syllabus below.
+    Keep each answer to a few sentences. If the syllabus does not cover a question, answer "{UNKNOWN_ANSWER}"
+
+    Questions:
+    {questions}
+
+    Reply with only a JSON object mapping each question key to its answer.
+
+    {context}"""
+
+
+def parse_answers(text):
+    """Map the model's reply to ``[{key, question, answer}]``; raises ``ValueError`` if it is not usable."""
+    match = JSON_BLOCK_RE.search(text or '')
+    if match is None:
+        raise ValueError("No JSON object in FAQ reply")
+    answers = json.loads(match.group())
+    if not isinstance(answers, dict):
+        raise ValueError("FAQ reply is not a JSON object")
+    items = []
+    for key, question, _, _ in FAQ_QUESTIONS:
+        answer = answers.get(key)
+        if isinstance(answer, str) and answer.strip():
+            items.append({'key': key, 'question': question, 'answer': answer.strip()})
+    if not items:
+        raise ValueError("FAQ reply answers none of the questions")
+    return items
+
+
+def faq_claim(digest):
+    # Identifies the answers for one text under the current questions
+    return f"{FAQ_VERSION}:{digest}"
+
+
+def faq_is_current(faq, text):
+    return bool(faq) and faq.get('version') == FAQ_VERSION and faq.get('text_hash') == text_hash(text)
+
+
+def match_faq(question, faq, ignore_terms=frozenset()):
+    """Return the stored FAQ item a question asks for, or ``None``.
+
+    A question matches when it mentions the FAQ's subject and everything else
+    it asks about is covered by that FAQ, so "when are office hours held?"
+    matches but "are office hours cancelled during reading week?" does not.
+    ``ignore_terms`` are terms that do not count either way, like the course name.
+    """
+    if not faq:
+        return None
+    terms = extract_terms(question or '') - ignore_terms
+    if not terms:
+        return None
+    items = {item['key']: item for item in faq.get('items', [])}
+    for key, _, required, allowed in FAQ_QUESTIONS:
+        if key in items and terms & required and terms <= allowed:
+            return items[key]
+    return None
+
+
+class FaqGenerator:
+    """Answers the standard FAQ for each syllabus in a background thread.
+
+    ``submit`` returns straight away; the job makes one ``generate(prompt)``
+    call for all questions and hands the result to ``store(faq)``. A syllabus
+    already being answered is not queued twice, and a call that fails because
+    the model is busy is retried after its ``retry_after``. A text whose
+    answers could not be generated is not tried again for ``retry_seconds``.
+    With ``claim``, the job first calls ``claim(faq_claim(digest))`` and skips
+    the text when that returns ``False``, so other processes can dedupe too.
+    """
+
+    def __init__(self, max_workers=1, token_budget=24000, per_doc_cap=12000, attempts=3, retry_seconds=600,
+                 max_tracked_failures=10000):
+        self.max_workers = max_workers
+        self.token_budget = token_budget
+        self.per_doc_cap = per_doc_cap
+        self.attempts = attempts
+        self.retry_seconds = retry_seconds
+        self.max_tracked_failures = max_tracked_failures
+
+        self._executor = None
+        self._executor_pid = None
+        self._in_flight = {}
+        self._failed = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, syllabus_id, course_name, text, generate, store, claim=None):
+        """Queue a syllabus text for answering; returns a future, or ``None`` while backing off."""
+        key = str(syllabus_id)
+        digest = text_hash(text)
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                return future
+            failed_at = self._failed.get((key, digest))
+            if failed_at is not None and time.monotonic() - failed_at < self.retry_seconds:
+                return None
+            future = self._in_flight[key] = self._get_executor().submit(
+                self._run, key, digest, course_name, text, generate, store, claim)
+        return future
+
+    def _run(self, key, digest, course_name, text, generate, store, claim):
+        try:
+            if claim is not None and not claim(faq_claim(digest)):
+                return
+            builder = PromptBuilder(self.token_budget, per_doc_cap=self.per_doc_cap)
+            builder.add(key, "Syllabus:\n", text)
+            prompt = build_prompt(course_name or 'this course', builder.build()['text'])
+
+            for attempt in range(self.attempts):
+                try:
+                    items = parse_answers(generate(prompt))
+                    break
+                except Exception as e:
+                    retry_after = getattr(e, 'retry_after', None)
+                    if retry_after is None or attempt == self.attempts - 1:
+                        raise
+                    time.sleep(retry_after)
+
+            store({'version': FAQ_VERSION, 'text_hash': digest, 'items': items})
+        except Exception as e:
+            print(f"Error generating FAQ for syllabus {key}: {str(e)}")
+            with self._lock:
+                self._failed[(key, digest)] = time.monotonic()
+                while len(self._failed) > self.max_tracked_failures:
+                    self._failed.popitem(last=False)
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def _get_executor(self):
+        # Created lazily so each gunicorn worker starts its own threads after forking; callers hold the lock
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='faq')
+            self._executor_pid = os.getpid()
+        return self._executor
@@ -0,0 +1,26 @@
+import os
+
+
+# gevent workers serve many requests at once, so time spent waiting on Supabase
+# or Gemini no longer ties up a whole worker. Set GUNICORN_WORKER_CLASS=sync to
+# go back to one request per worker.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gevent")
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+
+# Upper bound on requests a single gevent worker handles concurrently. Past
+# this, connections wait in the listen backlog instead of piling onto Gemini.
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", 100))
+
+# Streamed answers can take a while to finish
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+
+# GUNICORN_PRELOAD=1 imports the app once in the master and forks workers from
+# it, so workers start faster and share its memory. SDK clients, connection
+# pools and process pools are all created on first use in each worker, so
+# nothing is shared across the fork. gevent must patch the standard library
+# before the app is imported, which normally happens in each worker after
+# the fork, so with preloading it is done here instead.
+preload_app = os.getenv("GUNICORN_PRELOAD", "0") == "1"
+if preload_app and worker_class == "gevent":
+    from gevent import monkey
+    monkey.patch_all()
@@ -0,0 +1,238 @@
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from citations import CitationIndex
+from extraction import PAGE_BREAK, count_pdf_pages, extract_text_from_file, normalize_text
+from extraction_cache import EXTRACTOR_VERSION, ExtractionCache
+from term_index import encode_terms, extract_terms
+
+
+STATUS_PENDING = 'pending'
+STATUS_READY = 'ready'
+STATUS_FAILED = 'failed'
+
+
+# Set in each pool process by _init_worker
+_worker_cache = None
+
+
+def _init_worker(cache_dir, max_memory_bytes, max_disk_bytes):
+    global _worker_cache
+    _worker_cache = ExtractionCache(cache_dir, max_memory_bytes=max_memory_bytes, max_disk_bytes=max_disk_bytes)
+
+
+def _extract_job(file_path, page_range=None):
+    # Returns (text, cache tier or None) so the parent process can count cache hits
+    if page_range is None:
+        text, tier = _worker_cache.get_or_extract(file_path, extract_text_from_file)
+    else:
+        first_page, last_page = page_range
+        text, tier = _worker_cache.get_or_extract(
+            file_path,
+            lambda path: extract_text_from_file(path, page_range=page_range),
+            version=f"{EXTRACTOR_VERSION}-pages{first_page}-{last_page}"
+        )
+    if text is None:
+        raise ValueError(f"Could not extract text from {file_path}")
+    return normalize_text(text), tier
+
+
+def _count_pages_job(file_path):
+    return count_pdf_pages(file_path)
+
+
+class IngestQueue:
+    """Extracts uploaded files in a process pool and stores the text on their row.
+
+    ``store(table, row_id, fields)`` is called on one of ``store_workers``
+    threads once a job finishes, with either ``text_fields()`` of the extracted
+    text or a failed status. Large PDFs are split into page ranges that are
+    extracted in parallel. The pools are created lazily so every gunicorn
+    worker gets its own after forking. ``cache_stats()`` counts the extraction
+    cache lookups of this worker's jobs.
+    """
+
+    def __init__(self, cache_dir, max_workers=2, max_memory_bytes=32 * 1024 * 1024, max_disk_bytes=512 * 1024 * 1024,
+                 pages_per_job=25, split_min_bytes=1024 * 1024, store_workers=2):
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self.store_workers = store_workers
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.pages_per_job = pages_per_job
+        self.split_min_bytes = split_min_bytes
+
+        self._executor = None
+        self._executor_pid = None
+        self._store_executor = None
+        self._store_executor_pid = None
+        self._in_flight = {}
+        self._by_path = {}
+        self._lock = threading.Lock()
+        self._executor_lock = threading.Lock()
+        self._cache_lookups = {'memory': 0, 'disk': 0, None: 0}
+
+    def submit(self, table, row_id, file_path, store):
+        """Queue a row for extraction and return a future for its text.
+
+        A row that is already being extracted is not queued twice; its existing
+        future is returned instead, so callers can wait on it either way. Rows
+        pointing at the same stored file share a single extraction.
+        """
+        key = (table, str(row_id))
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                return future
+            future = self._by_path.get(file_path)
+            started = future is None
+            if started:
+                future = self._by_path[file_path] = Future()
+            self._in_flight[key] = future
+
+        # Jobs are submitted and callbacks added outside the lock, since callbacks run right away on a finished future
+        if started:
+            self._start(file_path, future)
+            future.add_done_callback(lambda f: self._forget_path(file_path, f))
+        # Done callbacks run on the process pool's result thread, so storing is handed to a thread of its own
+        future.add_done_callback(lambda f: self._get_store_executor().submit(self._finish, key, f, store))
+        return future
+
+    def _forget_path(self, file_path, future):
+        with self._lock:
+            if self._by_path.get(file_path) is future:
+                del self._by_path[file_path]
+
+    def _start(self, file_path, combined):
+        # Only a stat happens on the request path; reading a PDF's page tree is a pool job too
+        try:
+            executor = self._get_executor()
+            if file_path.lower().endswith('.pdf') and os.path.getsize(file_path) >= self.split_min_bytes:
+                counting = executor.submit(_count_pages_job, file_path)
+                counting.add_done_callback(lambda f: self._fan_out(file_path, f, combined))
+            else:
+                _chain(self._submit_job(executor, file_path), combined)
+        except Exception as e:
+            combined.set_exception(e)
+
+    def _fan_out(self, file_path, counting, combined):
+        # Large PDFs are split into page ranges extracted in parallel
+        try:
+            page_count = counting.result()
+        except Exception as e:
+            print(f"Error counting pages in {file_path}: {str(e)}")
+            page_count = 0
+
+        try:
+            executor = self._get_executor()
+            if page_count <= self.pages_per_job:
+                _chain(self._submit_job(executor, file_path), combined)
+                return
+            parts = [
+                self._submit_job(executor, file_path, (first, min(first + self.pages_per_job, page_count)))
+                for first in range(0, page_count, self.pages_per_job)
+            ]
+        except Exception as e:
+            combined.set_exception(e)
+            return
+
+        remaining = [len(parts)]
+        lock = threading.Lock()
+
+        def part_done(_):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            try:
+                combined.set_result(PAGE_BREAK.join(part.result()[0] for part in parts))
+            except Exception as e:
+                combined.set_exception(e)
+
+        for part in parts:
+            part.add_done_callback(part_done)
+
+    def _submit_job(self, executor, file_path, page_range=None):
+        job = executor.submit(_extract_job, file_path, page_range)
+        job.add_done_callback(self._count_lookup)
+        return job
+
+    def _count_lookup(self, job):
+        if not job.cancelled() and job.exception() is None:
+            with self._lock:
+                self._cache_lookups[job.result()[1]] += 1
+
+    def cache_stats(self):
+        with self._lock:
+            hits = self._cache_lookups['memory'] + self._cache_lookups['disk']
+            lookups = hits + self._cache_lookups[None]
+            return {
+                'hits': hits,
+                'misses': self._cache_lookups[None],
+                'hit_ratio': hits / lookups if lookups else 0.0,
+            }
+
+    def _finish(self, key, future, store):
+        table, row_id = key
+        try:
+            text = future.result()
+            fields = text_fields(text)
+        except Exception as e:
+            print(f"Extraction failed for {table} {row_id}: {str(e)}")
+            fields = {"extraction_status": STATUS_FAILED}
+
+        try:
+            store(table, row_id, fields)
+        except Exception as e:
+            print(f"Error storing extracted text for {table} {row_id}: {str(e)}")
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    initializer=_init_worker,
+                    initargs=(self.cache_dir, self.max_memory_bytes, self.max_disk_bytes)
+                )
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _get_store_executor(self):
+        with self._executor_lock:
+            if self._store_executor is None or self._store_executor_pid != os.getpid():
+                self._store_executor = ThreadPoolExecutor(max_workers=self.store_workers, thread_name_prefix='ingest-store')
+                self._store_executor_pid = os.getpid()
+            return self._store_executor
+
+
+def _chain(job, target):
+    # Completes ``target`` with the text of an ``_extract_job``, or its error
+    def done(future):
+        try:
+            target.set_result(future.result()[0])
+        except Exception as e:
+            target.set_exception(e)
+    job.add_done_callback(done)
+
+
+def text_fields(text):
+    # Everything derived from a row's text, computed once when the text is stored
+    return {
+        "extracted_text": text,
+        "extraction_status": STATUS_READY,
+        "citation_index": CitationIndex.from_text(text).encode(),
+        "term_index": encode_terms(extract_terms(text))
+    }
+
+
+def row_text(row):
+    # Text pasted into the form needs no extraction, so it is always usable
+    if row.get('content_type') == 'text':
+        return row.get('extracted_text') or row.get('content')
+    if row.get('extraction_status') == STATUS_READY:
+        return row.get('extracted_text')
+    return None
@@ -0,0 +1,340 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from prompt_builder import count_tokens
+
+
+class GatewayBusy(Exception):
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class GatewayError(Exception):
+    # The identical request this one shared a call with failed; the leader's error is the cause
+    pass
+
+
+class TokenBucket:
+    # Callers hold the gateway lock. Tokens are taken up front and the balance may go
+    # negative; the caller then waits until it would have been back at zero.
+    def __init__(self, tokens_per_minute):
+        self.capacity = tokens_per_minute
+        self.rate = tokens_per_minute / 60.0
+        self.tokens = float(tokens_per_minute)
+        self.updated = time.monotonic()
+
+    def reserve(self, tokens):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        # A prompt bigger than the whole budget waits for a full bucket rather than forever
+        self.tokens -= min(tokens, self.capacity)
+        return max(0.0, -self.tokens / self.rate)
+
+    def refund(self, tokens):
+        self.tokens += min(tokens, self.capacity)
+
+
+class _Flight:
+    # A call that identical requests share; a streaming leader also publishes its chunks as they arrive
+    def __init__(self):
+        self.done = threading.Event()
+        self.changed = threading.Condition()
+        self.parts = []
+        self.result = None
+        self.error = None
+
+    def add(self, text):
+        with self.changed:
+            self.parts.append(text)
+            self.changed.notify_all()
+
+    def finish(self, result):
+        with self.changed:
+            self.result = result
+            self.done.set()
+            self.changed.notify_all()
+
+    def fail(self, error):
+        with self.changed:
+            self.error = error
+            self.done.set()
+            self.changed.notify_all()
+
+
+class _Stream:
+    # Iterator over streamed text that gives its slot back when closed, even if it was never started
+    def __init__(self, chunks, on_close):
+        self._chunks = chunks
+        self._on_close = on_close
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._chunks)
+
+    def close(self):
+        on_close, self._on_close = self._on_close, None
+        if on_close is not None:
+            self._chunks.close()
+            on_close()
+
+    def __del__(self):
+        self.close()
+
+
+def _is_rate_limited(error):
+    return getattr(error, 'code', None) == 429 or 'RESOURCE_EXHAUSTED' in str(error)
+
+
+class LLMGateway:
+    """Admission control in front of the Gemini client.
+
+    Identical prompts that are already being answered share one call
+    (singleflight). New calls need a global slot, a per-user slot and room in
+    the token-per-minute budgets; a call that cannot get them within
+    ``queue_timeout`` seconds raises ``GatewayBusy`` so the route can answer
+    503 straight away instead of tying up a worker. Upstream 429s are turned
+    into ``GatewayBusy`` as well. A request that shared a call which failed
+    any other way raises ``GatewayError``.
+
+    ``models`` is a callable returning ``client.models``, so the client can be
+    swapped (tests, benchmarks) after the gateway is created. ``cached_content``
+    names a provider-side context cache the prompt continues from.
+    """
+
+    def __init__(self, models, model, max_concurrency=8, per_user_concurrency=2, tokens_per_minute=None,
+                 user_tokens_per_minute=None, queue_timeout=5.0, flight_timeout=120.0, max_tracked_users=10000):
+        self.models = models
+        self.model = model
+        self.per_user_concurrency = per_user_concurrency
+        self.user_tokens_per_minute = user_tokens_per_minute
+        self.queue_timeout = queue_timeout
+        self.flight_timeout = flight_timeout
+        self.max_tracked_users = max_tracked_users
+
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._user_changed = threading.Condition(self._lock)
+        self._user_in_flight = {}
+        self._bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._user_buckets = OrderedDict()
+        self._flights = {}
+
+        self.calls = 0
+        self.coalesced = 0
+        self.rejected = 0
+
+    def generate(self, prompt, user_id=None, tokens=None, cached_content=None):
+        key, flight, leader = self._join(prompt, cached_content)
+        if not leader:
+            return self._follow(flight)
+
+        try:
+            with self._admitted(user_id, prompt, tokens):
+                try:
+                    text = self.models().generate_content(
+                        model=self.model, contents=prompt, config=self._config(cached_content)).text
+                except Exception as e:
+                    raise self._translate(e)
+            flight.finish(text)
+            return text
+        except BaseException as e:
+            flight.fail(e)
+            raise
+        finally:
+            self._leave(key, flight)
+
+    def stream(self, prompt, user_id=None, tokens=None, cached_content=None):
+        """Return an iterator of text chunks; admission happens before this returns.
+
+        Callers should ``close()`` the iterator when done with it.
+        """
+        key, flight, leader = self._join(prompt, cached_content)
+        if not leader:
+            return _Stream(self._follow_stream(flight), lambda: None)
+
+        admitted = self._admitted(user_id, prompt, tokens)
+        try:
+            admitted.__enter__()
+        except BaseException as e:
+            flight.fail(e)
+            self._leave(key, flight)
+            raise
+
+        def chunks():
+            parts = []
+            try:
+                for chunk in self.models().generate_content_stream(
+                        model=self.model, contents=prompt, config=self._config(cached_content)):
+                    if chunk.text:
+                        parts.append(chunk.text)
+                        flight.add(chunk.text)
+                        yield chunk.text
+            except Exception as e:
+                error = self._translate(e)
+                flight.fail(error)
+                raise error
+            flight.finish(''.join(parts))
+
+        def on_close():
+            admitted.__exit__(None, None, None)
+            if not flight.done.is_set():
+                flight.fail(GatewayBusy("The answer this request was waiting for was cancelled"))
+            self._leave(key, flight)
+
+        return _Stream(chunks(), on_close)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'coalesced': self.coalesced,
+                'rejected': self.rejected,
+                'in_flight': sum(self._user_in_flight.values()),
+            }
+
+    def _config(self, cached_content):
+        return {'cached_content': cached_content} if cached_content else None
+
+    def _join(self, prompt, cached_content=None):
+        key = hashlib.sha256(f"{self.model}\x00{cached_content or ''}\x00{prompt}".encode('utf-8')).hexdigest()
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                return key, flight, False
+            flight = self._flights[key] = _Flight()
+            return key, flight, True
+
+    def _leave(self, key, flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def _follow(self, flight):
+        if not flight.done.wait(self.flight_timeout):
+            raise GatewayBusy("Timed out waiting for an identical request", retry_after=5)
+        self._raise_failed(flight)
+        return flight.result
+
+    def _follow_stream(self, flight):
+        # Yields the leader's chunks as they arrive; a leader that does not stream yields its whole text at the end
+        deadline = time.monotonic() + self.flight_timeout
+        sent = 0
+        while True:
+            with flight.changed:
+                while len(flight.parts) == sent and not flight.done.is_set():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise GatewayBusy("Timed out waiting for an identical request", retry_after=5)
+                    flight.changed.wait(remaining)
+                parts = flight.parts[sent:]
+                finished = flight.done.is_set()
+            for part in parts:
+                yield part
+            sent += len(parts)
+            if finished:
+                break
+        self._raise_failed(flight)
+        if not sent and flight.result:
+            yield flight.result
+
+    def _raise_failed(self, flight):
+        if isinstance(flight.error, GatewayBusy):
+            raise flight.error
+        if flight.error is not None:
+            raise GatewayError(f"An identical request failed: {flight.error}") from flight.error
+
+    @contextmanager
+    def _admitted(self, user_id, prompt, tokens):
+        if tokens is None:
+            tokens = count_tokens(prompt)
+        deadline = time.monotonic() + self.queue_timeout
+
+        self._reserve_tokens(user_id, tokens, deadline)
+        try:
+            self._acquire_user(user_id, deadline)
+        except GatewayBusy:
+            self._refund_tokens(user_id, tokens)
+            raise
+        try:
+            if not self._slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                self._reject()
+                raise GatewayBusy("Too many questions are being answered right now", retry_after=2)
+        except GatewayBusy:
+            self._release_user(user_id)
+            self._refund_tokens(user_id, tokens)
+            raise
+
+        with self._lock:
+            self.calls += 1
+        try:
+            yield
+        finally:
+            self._slots.release()
+            self._release_user(user_id)
+
+    def _reserve_tokens(self, user_id, tokens, deadline):
+        with self._lock:
+            buckets = self._buckets_for(user_id)
+            wait = max([bucket.reserve(tokens) for bucket in buckets], default=0.0)
+            if wait > deadline - time.monotonic():
+                for bucket in buckets:
+                    bucket.refund(tokens)
+                self.rejected += 1
+                raise GatewayBusy("The question budget is used up for now", retry_after=wait)
+        if wait:
+            time.sleep(wait)
+
+    def _refund_tokens(self, user_id, tokens):
+        with self._lock:
+            for bucket in self._buckets_for(user_id):
+                bucket.refund(tokens)
+
+    def _buckets_for(self, user_id):
+        buckets = [self._bucket] if self._bucket else []
+        if self.user_tokens_per_minute and user_id is not None:
+            bucket = self._user_buckets.get(user_id)
+            if bucket is None:
+                bucket = self._user_buckets[user_id] = TokenBucket(self.user_tokens_per_minute)
+                while len(self._user_buckets) > self.max_tracked_users:
+                    self._user_buckets.popitem(last=False)
+            self._user_buckets.move_to_end(user_id)
+            buckets.append(bucket)
+        return buckets
+
+    def _acquire_user(self, user_id, deadline):
+        with self._user_changed:
+            while self._user_in_flight.get(user_id, 0) >= self.per_user_concurrency:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.rejected += 1
+                    raise GatewayBusy("You already have questions being answered", retry_after=2)
+                self._user_changed.wait(remaining)
+            self._user_in_flight[user_id] = self._user_in_flight.get(user_id, 0) + 1
+
+    def _release_user(self, user_id):
+        with self._user_changed:
+            count = self._user_in_flight.get(user_id, 0) - 1
+            if count > 0:
+                self._user_in_flight[user_id] = count
+            else:
+                self._user_in_flight.pop(user_id, None)
+            self._user_changed.notify_all()
+
+    def _reject(self):
+        with self._lock:
+            self.rejected += 1
+
+    def _translate(self, error):
+        if _is_rate_limited(error):
+            with self._lock:
+                self.rejected += 1
+            return GatewayBusy("Gemini is rate limiting requests", retry_after=5)
+        return error
@@ -0,0 +1,84 @@
+import json
+
+from ttl_cache import TTLCache
+
+
+class MetadataCache:
+    """Short-lived per-user cache of syllabi/documents listings.
+
+    Entries live in process memory by default. When ``redis_url`` is set (and
+    the optional ``redis`` package is installed) they are kept in Redis instead,
+    so every gunicorn worker sees the same entries and the same invalidations.
+    Each user's entries are stored together so one call drops all of them.
+    """
+
+    def __init__(self, ttl=30, maxsize=4096, redis_url=None):
+        self.ttl = ttl
+        self._local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._redis = None
+        self._redis_hits = 0
+        self._redis_misses = 0
+
+        if redis_url:
+            try:
+                import redis
+                self._redis = redis.Redis.from_url(redis_url)
+            except ImportError:
+                print("REDIS_URL is set but the redis package is not installed; using the in-process metadata cache")
+
+    def get_or_load(self, user_id, key, loader):
+        if self._redis is not None:
+            return self._redis_get_or_load(user_id, key, loader)
+
+        cache_key = (user_id, key)
+        value = self._local.get(cache_key)
+        if value is None:
+            value = loader()
+            self._local.set(cache_key, value, tags=[f"user:{user_id}"])
+        return value
+
+    def invalidate_user(self, user_id):
+        if self._redis is not None:
+            try:
+                self._redis.delete(self._redis_key(user_id))
+            except Exception as e:
+                print(f"Error invalidating metadata cache for {user_id}: {str(e)}")
+            return
+        self._local.invalidate_tag(f"user:{user_id}")
+
+    def stats(self):
+        if self._redis is not None:
+            lookups = self._redis_hits + self._redis_misses
+            return {
+                'hits': self._redis_hits,
+                'misses': self._redis_misses,
+                'hit_ratio': self._redis_hits / lookups if lookups else 0.0,
+            }
+        return self._local.stats()
+
+    def _redis_key(self, user_id):
+        return f"sylliai:metadata:{user_id}"
+
+    def _redis_get_or_load(self, user_id, key, loader):
+        redis_key = self._redis_key(user_id)
+        try:
+            cached = self._redis.hget(redis_key, key)
+        except Exception as e:
+            # A Redis outage should slow pages down, not break them
+            print(f"Error reading metadata cache: {str(e)}")
+            return loader()
+
+        if cached is not None:
+            self._redis_hits += 1
+            return json.loads(cached)
+
+        self._redis_misses += 1
+        value = loader()
+        try:
+            pipeline = self._redis.pipeline()
+            pipeline.hset(redis_key, key, json.dumps(value))
+            pipeline.expire(redis_key, self.ttl)
+            pipeline.execute()
+        except Exception as e:
+            print(f"Error writing metadata cache: {str(e)}")
+        return value
@@ -0,0 +1,16 @@
+-- Text extracted from uploaded files at ingest time, read by the chat routes
+alter table syllabi
+    add column if not exists extracted_text text,
+    add column if not exists extraction_status text
+        check (extraction_status in ('pending', 'ready', 'failed'));
+
+alter table documents
+    add column if not exists extracted_text text,
+    add column if not exists extraction_status text
+        check (extraction_status in ('pending', 'ready', 'failed'));
+
+-- Pasted text needs no extraction
+update syllabi set extracted_text = content, extraction_status = 'ready'
+    where content_type = 'text' and extraction_status is null;
+update documents set extracted_text = content, extraction_status = 'ready'
+    where content_type = 'text' and extraction_status is null;
@@ -0,0 +1,6 @@
+-- Page and line start offsets into extracted_text, written at ingest (see citations.py)
+alter table syllabi
+    add column if not exists citation_index text;
+
+alter table documents
+    add column if not exists citation_index text;
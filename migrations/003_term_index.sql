@@ -0,0 +1,6 @@
+-- Space-separated stemmed terms of extracted_text, written at ingest (see term_index.py)
+alter table syllabi
+    add column if not exists term_index text;
+
+alter table documents
+    add column if not exists term_index text;
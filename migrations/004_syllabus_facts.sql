@@ -0,0 +1,27 @@
+-- Grading weights, attendance policy and exam/assignment dates extracted at ingest (see facts.py).
+-- The whole set is kept on the syllabus row; syllabus_facts has one row per fact for the
+-- calendar and dashboard, which query dates across all of a user's syllabi.
+alter table syllabi
+    add column if not exists facts jsonb;
+
+create table if not exists syllabus_facts (
+    id uuid primary key default gen_random_uuid(),
+    syllabus_id uuid not null references syllabi (id) on delete cascade,
+    user_id uuid not null,
+    kind text not null check (kind in ('grading', 'attendance', 'exam', 'assignment')),
+    label text not null,
+    weight numeric,
+    due_date date,
+    date_text text,
+    details text,
+    created_at timestamptz not null default now()
+);
+
+create index if not exists syllabus_facts_syllabus_id_idx on syllabus_facts (syllabus_id);
+create index if not exists syllabus_facts_user_due_date_idx on syllabus_facts (user_id, due_date)
+    where due_date is not null;
+
+alter table syllabus_facts enable row level security;
+
+create policy "Users manage their own syllabus facts" on syllabus_facts
+    for all using (auth.uid() = user_id) with check (auth.uid() = user_id);
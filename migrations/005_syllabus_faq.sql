@@ -0,0 +1,3 @@
+-- Answers to the standard student questions, generated in the background per syllabus text (see faq.py)
+alter table syllabi
+    add column if not exists faq jsonb;
@@ -0,0 +1,4 @@
+-- The FAQ text a worker has claimed to answer, so workers never generate the same answers twice (see data_access.claim_faq)
+alter table syllabi
+    add column if not exists faq_claim text,
+    add column if not exists faq_claimed_at timestamptz;
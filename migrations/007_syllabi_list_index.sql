@@ -0,0 +1,2 @@
+-- Serves the dashboard's keyset pages: a user's syllabi ordered by (created_at, id), newest first (see data_access.list_syllabi)
+create index if not exists syllabi_user_created_at_id_idx on syllabi (user_id, created_at desc, id desc);
@@ -0,0 +1,88 @@
+import re
+
+
+# Approximates a BPE tokenizer: about four characters of a word per token, and
+# every punctuation mark is its own token
+TOKEN_RE = re.compile(r"\w{1,4}|[^\w\s]")
+
+
+def count_tokens(text):
+    return len(TOKEN_RE.findall(text))
+
+
+def truncate_to_tokens(text, max_tokens):
+    if max_tokens <= 0:
+        return ''
+    for i, match in enumerate(TOKEN_RE.finditer(text)):
+        if i == max_tokens:
+            return text[:match.start()].rstrip()
+    return text
+
+
+class PromptBuilder:
+    """Packs context passages into a prompt under a token budget.
+
+    Passages are taken in the order they were added, so callers add the most
+    important ones first. Long lines that already appeared earlier in the
+    prompt (headers, university policy boilerplate, overlapping chunks) are
+    dropped, each document is limited to ``per_doc_cap`` tokens, and whatever
+    does not fit the budget is truncated or left out.
+    """
+
+    def __init__(self, budget, per_doc_cap=None, min_dedup_chars=30):
+        self.budget = budget
+        self.per_doc_cap = per_doc_cap
+        self.min_dedup_chars = min_dedup_chars
+        self._parts = []
+
+    def add(self, doc_id, header, text, key=None):
+        self._parts.append((doc_id, header, text, key))
+
+    def build(self):
+        seen_lines = set()
+        per_doc = {}
+        blocks = []
+        included = []
+        used = dropped = duplicate = 0
+
+        for doc_id, header, text, key in self._parts:
+            lines = []
+            for line in text.split('\n'):
+                normalized = ' '.join(line.lower().split())
+                if len(normalized) >= self.min_dedup_chars:
+                    if normalized in seen_lines:
+                        duplicate += count_tokens(line)
+                        continue
+                    seen_lines.add(normalized)
+                lines.append(line)
+            text = '\n'.join(lines).strip()
+            if not text:
+                continue
+
+            tokens = count_tokens(text)
+            header_tokens = count_tokens(header)
+            allowed = self.budget - used
+            if self.per_doc_cap is not None:
+                allowed = min(allowed, self.per_doc_cap - per_doc.get(doc_id, 0))
+
+            if allowed <= header_tokens:
+                dropped += tokens
+                continue
+            if header_tokens + tokens > allowed:
+                text = truncate_to_tokens(text, allowed - header_tokens)
+                kept = count_tokens(text)
+                dropped += tokens - kept
+                tokens = kept
+
+            blocks.append(header + text)
+            included.append(key)
+            used += header_tokens + tokens
+            per_doc[doc_id] = per_doc.get(doc_id, 0) + header_tokens + tokens
+
+        return {
+            'text': '\n\n'.join(blocks),
+            'included': included,
+            'used_tokens': used,
+            'dropped_tokens': dropped,
+            'duplicate_tokens': duplicate,
+        }
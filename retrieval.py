@@ -0,0 +1,353 @@
+import hashlib
+import json
+import math
+import os
+import re
+import tempfile
+import threading
+import zlib
+from collections import Counter, OrderedDict
+
+from extraction import PAGE_BREAK
+from prompt_builder import count_tokens
+
+
+# Bump when chunking or tokenizing changes; older snapshots are then ignored and rebuilt
+INDEX_VERSION = 1
+
+CHUNK_WORDS = 180
+CHUNK_OVERLAP_WORDS = 30
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+CHUNK_WORD_RE = re.compile(r"\S+")
+
+
+def tokenize(text):
+    return WORD_RE.findall(text.lower())
+
+
+def chunk_document(doc_id, course_name, text):
+    """Split a document into overlapping word windows that never cross a page.
+
+    Each chunk records its 1-based page number and the character offsets of the
+    chunk within ``text`` so answers can point back at the source.
+    """
+    chunks = []
+    page_start = 0
+    for page_number, page in enumerate(text.split(PAGE_BREAK), start=1):
+        words = list(CHUNK_WORD_RE.finditer(page))
+        step = CHUNK_WORDS - CHUNK_OVERLAP_WORDS
+        for first in range(0, len(words), step):
+            window = words[first:first + CHUNK_WORDS]
+            start = page_start + window[0].start()
+            end = page_start + window[-1].end()
+            chunks.append({
+                'doc_id': doc_id,
+                'course_name': course_name,
+                'page': page_number,
+                'start': start,
+                'end': end,
+                'text': text[start:end]
+            })
+            if first + CHUNK_WORDS >= len(words):
+                break
+        page_start += len(page) + len(PAGE_BREAK)
+    return chunks
+
+
+def doc_signature(text):
+    # Cheap and stable across processes, so a snapshot can be checked against the current text
+    return f"{len(text)}:{zlib.crc32(text.encode('utf-8')):08x}"
+
+
+class BM25Index:
+    """BM25 over chunked documents that are added and removed one at a time.
+
+    Postings map a term to ``{chunk_id: tf}`` and every chunk keeps its own term
+    counts, so adding or removing a document touches only the postings of the
+    terms in its chunks. Each document belongs to a group (its syllabus).
+    """
+
+    def __init__(self, chunks=(), k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+
+        self.chunks = {}
+        self.lengths = {}
+        self.postings = {}
+        self.docs = {}
+        self._counts = {}
+        self._total_length = 0
+        self._next_id = 0
+        self._lock = threading.RLock()
+        # Held by RetrievalIndexes while it snapshots and writes this index
+        self._save_lock = threading.Lock()
+
+        for chunk in chunks:
+            self._add_chunk(chunk, Counter(tokenize(chunk['text'])))
+
+    @property
+    def avg_length(self):
+        return self._total_length / len(self.lengths) if self.lengths else 0.0
+
+    def signature(self, doc_id):
+        doc = self.docs.get(doc_id)
+        return doc['signature'] if doc else None
+
+    def add_document(self, doc_id, course_name, text, group=None, signature=None):
+        with self._lock:
+            self.remove_document(doc_id)
+            chunk_ids = [self._add_chunk(chunk, Counter(tokenize(chunk['text'])))
+                         for chunk in chunk_document(doc_id, course_name, text)]
+            self.docs[doc_id] = {
+                'group': group,
+                'course_name': course_name,
+                'signature': signature or doc_signature(text),
+                'chunk_ids': chunk_ids,
+                'attached': True
+            }
+
+    def remove_document(self, doc_id):
+        with self._lock:
+            doc = self.docs.pop(doc_id, None)
+            if doc is None:
+                return False
+            for chunk_id in doc['chunk_ids']:
+                for term in self._counts.pop(chunk_id):
+                    postings = self.postings[term]
+                    del postings[chunk_id]
+                    if not postings:
+                        del self.postings[term]
+                self._total_length -= self.lengths.pop(chunk_id)
+                del self.chunks[chunk_id]
+            return True
+
+    def remove_group(self, group):
+        with self._lock:
+            doc_ids = [doc_id for doc_id, doc in self.docs.items() if doc['group'] == group]
+            for doc_id in doc_ids:
+                self.remove_document(doc_id)
+            return doc_ids
+
+    def attach_text(self, doc_id, text):
+        # Chunks restored from a snapshot get their text back from the document
+        with self._lock:
+            doc = self.docs[doc_id]
+            if doc['attached']:
+                return
+            for chunk_id in doc['chunk_ids']:
+                chunk = self.chunks[chunk_id]
+                chunk['text'] = text[chunk['start']:chunk['end']]
+            doc['attached'] = True
+
+    def search(self, query, doc_ids=None):
+        """Return ``[(chunk_id, score)]``, best first, optionally only over ``doc_ids``."""
+        scores = {}
+        with self._lock:
+            n = len(self.chunks)
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for i, tf in postings.items():
+                    if doc_ids is not None and self.chunks[i]['doc_id'] not in doc_ids:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self.lengths[i] / self.avg_length)
+                    scores[i] = scores.get(i, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+    def to_snapshot(self):
+        # Chunk text is left out; it is sliced from the document again after loading
+        with self._lock:
+            return {
+                'version': INDEX_VERSION,
+                'docs': [[doc_id, doc['group'], doc['course_name'], doc['signature']]
+                         for doc_id, doc in self.docs.items()],
+                'chunks': [[chunk_id, chunk['doc_id'], chunk['page'], chunk['start'], chunk['end'], self._counts[chunk_id]]
+                           for chunk_id, chunk in self.chunks.items()]
+            }
+
+    @classmethod
+    def from_snapshot(cls, snapshot, k1=1.5, b=0.75):
+        if snapshot.get('version') != INDEX_VERSION:
+            raise ValueError("Retrieval snapshot is from another index version")
+        index = cls(k1=k1, b=b)
+        for doc_id, group, course_name, signature in snapshot['docs']:
+            index.docs[doc_id] = {'group': group, 'course_name': course_name, 'signature': signature,
+                                  'chunk_ids': [], 'attached': False}
+        for chunk_id, doc_id, page, start, end, counts in snapshot['chunks']:
+            index._next_id = chunk_id
+            index._add_chunk({
+                'doc_id': doc_id,
+                'course_name': index.docs[doc_id]['course_name'],
+                'page': page,
+                'start': start,
+                'end': end,
+                'text': None
+            }, counts)
+            index.docs[doc_id]['chunk_ids'].append(chunk_id)
+        return index
+
+    def _add_chunk(self, chunk, counts):
+        chunk_id = self._next_id
+        self._next_id += 1
+        self.chunks[chunk_id] = chunk
+        self._counts[chunk_id] = counts
+        self.lengths[chunk_id] = sum(counts.values())
+        self._total_length += self.lengths[chunk_id]
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[chunk_id] = tf
+        return chunk_id
+
+
+class RetrievalIndexes:
+    """Per-user incremental BM25 indexes over syllabi and their documents.
+
+    ``get`` brings a user's index in line with the documents it is given by
+    comparing content signatures: only documents that are new, changed or gone
+    are re-chunked or dropped, never the whole index. ``add``, ``remove`` and
+    ``remove_syllabus`` apply uploads and deletes as they happen. Each change
+    is written to a per-user snapshot under ``snapshot_dir`` so a restarted
+    worker, or an index evicted from memory, is loaded from disk instead of
+    re-chunking every file.
+
+    Documents are dicts with ``key``, ``syllabus_id``, ``course_name`` and
+    ``content``; chunks carry the ``key`` as their ``doc_id``.
+    """
+
+    def __init__(self, snapshot_dir=None, max_users=256):
+        self.snapshot_dir = snapshot_dir
+        self.max_users = max_users
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+        if snapshot_dir:
+            os.makedirs(snapshot_dir, exist_ok=True)
+
+    def get(self, user_id, docs, syllabus_id=None):
+        """Return the user's index, updated for ``docs``.
+
+        ``docs`` must be every document the user has, or, with
+        ``syllabus_id``, every document of that syllabus; indexed documents
+        missing from it are dropped.
+        """
+        index = self._index(user_id)
+        changed = False
+        with index._lock:
+            wanted = {}
+            for doc in docs:
+                wanted[doc['key']] = doc
+                signature = doc_signature(doc['content'])
+                if index.signature(doc['key']) == signature:
+                    index.attach_text(doc['key'], doc['content'])
+                    continue
+                index.add_document(doc['key'], doc['course_name'], doc['content'],
+                                   group=doc['syllabus_id'], signature=signature)
+                changed = True
+            for doc_id, doc in list(index.docs.items()):
+                if doc_id not in wanted and (syllabus_id is None or doc['group'] == syllabus_id):
+                    index.remove_document(doc_id)
+                    changed = True
+        if changed:
+            self._save(user_id, index)
+        return index
+
+    def add(self, user_id, doc):
+        # Indexes not in memory are left alone; the next ``get`` picks the document up
+        index = self._cached(user_id)
+        if index is None:
+            return
+        index.add_document(doc['key'], doc['course_name'], doc['content'], group=doc['syllabus_id'])
+        self._save(user_id, index)
+
+    def remove(self, user_id, doc_id):
+        index = self._cached(user_id)
+        if index is not None and index.remove_document(doc_id):
+            self._save(user_id, index)
+
+    def remove_syllabus(self, user_id, syllabus_id):
+        # The syllabus and every document attached to it
+        index = self._cached(user_id)
+        if index is None:
+            return
+        if index.remove_group(syllabus_id):
+            self._save(user_id, index)
+
+    def _cached(self, user_id):
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None:
+                self._indexes.move_to_end(user_id)
+            return index
+
+    def _index(self, user_id):
+        index = self._cached(user_id)
+        if index is not None:
+            return index
+
+        index = self._load(user_id) or BM25Index()
+        with self._lock:
+            # Another request may have loaded it meanwhile; keep the first so updates are not split
+            index = self._indexes.setdefault(user_id, index)
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+        return index
+
+    def _snapshot_path(self, user_id):
+        name = hashlib.sha256(str(user_id).encode('utf-8')).hexdigest()[:32]
+        return os.path.join(self.snapshot_dir, f"{name}.json.z")
+
+    def _load(self, user_id):
+        if not self.snapshot_dir:
+            return None
+        try:
+            with open(self._snapshot_path(user_id), 'rb') as f:
+                index = BM25Index.from_snapshot(json.loads(zlib.decompress(f.read())))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError, zlib.error) as e:
+            print(f"Error loading retrieval snapshot: {str(e)}")  # For debugging
+            return None
+        return index
+
+    def _save(self, user_id, index):
+        if not self.snapshot_dir:
+            return
+        # Saves of one index take turns and each snapshots the index once it has its turn,
+        # so the last write always holds every change made before it
+        with index._save_lock:
+            data = zlib.compress(json.dumps(index.to_snapshot(), separators=(',', ':')).encode('utf-8'), 1)
+            path = self._snapshot_path(user_id)
+            try:
+                fd, tmp_path = tempfile.mkstemp(dir=self.snapshot_dir, suffix='.tmp')
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"Error saving retrieval snapshot: {str(e)}")  # For debugging
+
+
+def select_chunks(index, query, top_k=8, token_budget=6000, doc_ids=None):
+    ranked = [index.chunks[i] for i, _ in index.search(query, doc_ids)[:top_k]]
+
+    # Questions with no overlapping terms ("summarize my courses") get the start of each document
+    if not ranked:
+        seen = set()
+        for chunk in list(index.chunks.values()):
+            if doc_ids is not None and chunk['doc_id'] not in doc_ids:
+                continue
+            if chunk['doc_id'] not in seen:
+                seen.add(chunk['doc_id'])
+                ranked.append(chunk)
+
+    selected = []
+    used = 0
+    for chunk in ranked:
+        tokens = count_tokens(chunk['text'])
+        if used + tokens > token_budget:
+            continue
+        selected.append(chunk)
+        used += tokens
+    return selected
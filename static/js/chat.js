@@ -0,0 +1,104 @@
+// Shared by chat.html and syllabus_detail.html. Asks the server for a
+// Server-Sent Events stream and renders tokens as they arrive; routes that
+// answer with plain JSON (errors, older servers) are still handled. Each
+// chat URL keeps the conversation id the server hands back, so follow-up
+// questions are answered with the earlier turns in mind.
+
+const conversationIds = {};
+
+function appendChatLine(chatMessages, text, className) {
+    const line = document.createElement('div');
+    line.textContent = text;
+    line.className = className;
+    chatMessages.appendChild(line);
+    return line;
+}
+
+function showChatMeta(chatMessages, meta) {
+    if (meta.history_dropped) {
+        appendChatLine(chatMessages, 'Earlier messages in this chat were not available, so this answer does not take them into account.',
+            'text-left text-yellow-600 text-sm mb-2');
+    }
+    if (meta.warning) {
+        appendChatLine(chatMessages, meta.warning, 'text-left text-yellow-600 text-sm mb-2');
+    }
+    const skipped = (meta.sources || []).filter(source => source.skipped);
+    const label = source => source.document_name || source.course_name;
+    const processing = skipped.filter(source => source.reason === 'processing').map(label);
+    const failed = skipped.filter(source => source.reason === 'failed').map(label);
+    if (processing.length) {
+        appendChatLine(chatMessages,
+            `Still processing: ${processing.join(', ')}. These were not included in this answer.`,
+            'text-left text-yellow-600 text-sm mb-2');
+    }
+    if (failed.length) {
+        appendChatLine(chatMessages,
+            `Could not read: ${failed.join(', ')}. Try uploading these again.`,
+            'text-left text-red-500 text-sm mb-2');
+    }
+}
+
+async function sendChatMessage(url, message, chatMessages, md) {
+    const response = await fetch(url, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Accept': 'text/event-stream, application/json'
+        },
+        body: JSON.stringify({ message, conversation_id: conversationIds[url] })
+    });
+
+    const contentType = response.headers.get('Content-Type') || '';
+    if (!contentType.startsWith('text/event-stream')) {
+        const data = await response.json();
+        if (data.error) {
+            appendChatLine(chatMessages, `Error: ${data.error}`, 'text-left text-red-500 mb-2');
+        } else {
+            if (data.conversation_id) conversationIds[url] = data.conversation_id;
+            const aiMessage = appendChatLine(chatMessages, '', 'text-left text-gray-700 mb-2');
+            aiMessage.innerHTML = md.render(data.response || '');
+            showChatMeta(chatMessages, data);
+        }
+        return;
+    }
+
+    const aiMessage = appendChatLine(chatMessages, '', 'text-left text-gray-700 mb-2');
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let answer = '';
+    let meta = {};
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const frame = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            let event = 'message';
+            let data = '';
+            for (const line of frame.split('\n')) {
+                if (line.startsWith('event: ')) event = line.slice(7);
+                else if (line.startsWith('data: ')) data += line.slice(6);
+            }
+            const payload = data ? JSON.parse(data) : {};
+
+            if (event === 'meta') {
+                meta = payload;
+                if (meta.conversation_id) conversationIds[url] = meta.conversation_id;
+            } else if (event === 'token') {
+                answer += payload.text;
+                aiMessage.innerHTML = md.render(answer);
+                chatMessages.scrollTop = chatMessages.scrollHeight;
+            } else if (event === 'error') {
+                appendChatLine(chatMessages, `Error: ${payload.error}`, 'text-left text-red-500 mb-2');
+            }
+        }
+    }
+
+    showChatMeta(chatMessages, meta);
+}
@@ -0,0 +1,154 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+
+
+class AuthError(Exception):
+    pass
+
+
+class TokenExpired(AuthError):
+    pass
+
+
+def _b64decode(segment):
+    return base64.urlsafe_b64decode(segment + '=' * (-len(segment) % 4))
+
+
+def decode_jwt(token, secret=None, leeway=10):
+    """Decode a Supabase access token and check its expiry.
+
+    When ``secret`` (the project's JWT secret) is given the HS256 signature is
+    verified too. Without it the claims are only read locally and PostgREST
+    still rejects forged tokens on the first query.
+    """
+    try:
+        header_segment, payload_segment, signature_segment = token.split('.')
+        header = json.loads(_b64decode(header_segment))
+        claims = json.loads(_b64decode(payload_segment))
+    except (ValueError, TypeError) as e:
+        raise AuthError(f"Malformed access token: {str(e)}")
+
+    if secret:
+        if header.get('alg') != 'HS256':
+            raise AuthError(f"Unsupported token algorithm {header.get('alg')}")
+        expected = hmac.new(secret.encode('utf-8'), f"{header_segment}.{payload_segment}".encode('ascii'), hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, _b64decode(signature_segment)):
+            raise AuthError("Invalid access token signature")
+
+    if 'exp' in claims and claims['exp'] + leeway < time.time():
+        raise TokenExpired("Access token expired")
+    return claims
+
+
+class _AuthorizedSession:
+    # Looks enough like the httpx client postgrest expects, adding the user's token to each request
+    def __init__(self, http, authorization):
+        self._http = http
+        self._authorization = authorization
+
+    def request(self, method, path, headers=None, **kwargs):
+        headers = dict(headers or {})
+        headers['Authorization'] = self._authorization
+        return self._http.request(method, path, headers=headers, **kwargs)
+
+
+class UserClient:
+    def __init__(self, http, access_token):
+        self._session = _AuthorizedSession(http, f"Bearer {access_token}")
+
+    def table(self, name):
+        from postgrest._sync.request_builder import SyncRequestBuilder
+        return SyncRequestBuilder(self._session, f"/{name}")
+
+
+class SupabasePool:
+    """Hands out per-request database clients that share one connection pool.
+
+    Each client carries the user's own access token, so nothing is stored on a
+    shared client and concurrent requests cannot see each other's auth state.
+    Tokens are only refreshed when they are about to expire. The HTTP clients
+    are created on first use, so every gunicorn worker opens its own
+    connections after forking.
+    """
+
+    def __init__(self, url, key, jwt_secret=None, refresh_margin=60, timeout=30, max_connections=100, service_key=None):
+        self.url = url
+        self.key = key
+        self.jwt_secret = jwt_secret
+        self.service_key = service_key
+        self.refresh_margin = refresh_margin
+        self.timeout = timeout
+        self.max_connections = max_connections
+
+        self._http = None
+        self._http_pid = None
+        self._lock = threading.Lock()
+
+    def _clients(self):
+        # (rest, auth) httpx clients for this process
+        with self._lock:
+            if self._http is None or self._http_pid != os.getpid():
+                import httpx
+                limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+                rest = httpx.Client(
+                    base_url=f"{self.url}/rest/v1",
+                    headers={'apikey': self.key, 'Accept': 'application/json', 'Content-Type': 'application/json'},
+                    timeout=self.timeout,
+                    limits=limits,
+                    http2=True,
+                    follow_redirects=True
+                )
+                auth = httpx.Client(
+                    base_url=f"{self.url}/auth/v1",
+                    headers={'apikey': self.key, 'Content-Type': 'application/json'},
+                    timeout=self.timeout
+                )
+                self._http = (rest, auth)
+                self._http_pid = os.getpid()
+            return self._http
+
+    def client_for(self, access_token, refresh_token, user_id=None):
+        """Return ``(client, refreshed_tokens)``.
+
+        ``refreshed_tokens`` is ``None`` unless the access token was close to
+        expiry and had to be exchanged, in which case the caller should store
+        the new pair.
+        """
+        refreshed = None
+        try:
+            claims = decode_jwt(access_token, self.jwt_secret, leeway=-self.refresh_margin)
+        except TokenExpired:
+            refreshed = self.refresh(refresh_token)
+            access_token = refreshed['access_token']
+            claims = decode_jwt(access_token, self.jwt_secret)
+
+        if user_id is not None and claims.get('sub') != user_id:
+            raise AuthError("Access token does not belong to this user")
+
+        return UserClient(self._clients()[0], access_token), refreshed
+
+    def background_client(self, access_token):
+        """Return a client for work that outlives the request, like ingest and FAQ jobs.
+
+        These never refresh the user's session: Supabase refresh tokens are
+        single-use, so spending the one still in the user's cookie would break
+        their next refresh. With a service-role key the job writes as the
+        service; otherwise it uses the access token it was started with and
+        raises ``TokenExpired`` once that has expired.
+        """
+        if self.service_key:
+            return UserClient(self._clients()[0], self.service_key)
+        decode_jwt(access_token, self.jwt_secret, leeway=0)
+        return UserClient(self._clients()[0], access_token)
+
+    def refresh(self, refresh_token):
+        response = self._clients()[1].post('/token', params={'grant_type': 'refresh_token'}, json={'refresh_token': refresh_token})
+        if not response.is_success:
+            raise AuthError(f"Could not refresh session: {response.text}")
+        data = response.json()
+        return {'access_token': data['access_token'], 'refresh_token': data['refresh_token']}
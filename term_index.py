@@ -0,0 +1,99 @@
+import threading
+from collections import OrderedDict
+
+from retrieval import tokenize
+
+
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being below between
+both but by can could did do does doing down during each few for from further had has have having he her
+here hers him his how i if in into is it its itself just me more most my no nor not now of off on once
+only or other our ours out over own please same she should so some such than that the their theirs them
+then there these they this those through to too under until up very was we were what when where which
+while who whom why will with would you your yours tell know explain give find say said also get got
+""".split())
+
+
+def stem(word):
+    # A light suffix stripper: enough to match grade/grades/graded/grading, not a full Porter stemmer
+    if len(word) <= 3 or word.isdigit():
+        return word
+    if word.endswith('ies') and len(word) > 4:
+        return word[:-3] + 'y'
+    for suffix in ('ing', 'ed'):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[:-len(suffix)]
+            if word[-1] == word[-2] and word[-1] not in 'lsz':
+                word = word[:-1]
+            break
+    else:
+        if word.endswith(('sses', 'shes', 'ches', 'xes', 'zes')):
+            word = word[:-2]
+            if word.endswith('zz'):
+                word = word[:-1]
+        elif word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+            word = word[:-1]
+    if word.endswith('e') and len(word) >= 5:
+        word = word[:-1]
+    return word
+
+
+def extract_terms(text):
+    return {stem(word) for word in tokenize(text) if len(word) > 1 and word not in STOPWORDS}
+
+
+def encode_terms(terms):
+    return ' '.join(sorted(terms))
+
+
+def row_terms(row, text):
+    # Rows ingested before term_index existed get their terms from the text
+    stored = row.get('term_index')
+    if stored is not None:
+        return set(stored.split())
+    return extract_terms(text or '')
+
+
+def coverage(question, terms):
+    """Score how much of a question the indexed terms cover.
+
+    Returns ``(score, missing)`` where ``score`` is the share of the
+    question's content terms found in ``terms`` and ``missing`` lists the rest.
+    Questions made only of stopwords count as covered.
+    """
+    wanted = extract_terms(question)
+    if not wanted:
+        return 1.0, []
+    missing = sorted(wanted - terms)
+    return 1 - len(missing) / len(wanted), missing
+
+
+class TermIndexes:
+    """Per-syllabus term sets covering the syllabus and its documents.
+
+    Each row stores its own terms at ingest; the union for a syllabus is built
+    here once and reused until one of the rows changes.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, rows_with_text):
+        fingerprint = tuple((row['id'], hash(row.get('term_index') or text or '')) for row, text in rows_with_text)
+
+        with self._lock:
+            cached = self._indexes.get(key)
+            if cached and cached[0] == fingerprint:
+                self._indexes.move_to_end(key)
+                return cached[1]
+
+        terms = frozenset().union(*(row_terms(row, text) for row, text in rows_with_text))
+
+        with self._lock:
+            self._indexes[key] = (fingerprint, terms)
+            self._indexes.move_to_end(key)
+            while len(self._indexes) > self.max_entries:
+                self._indexes.popitem(last=False)
+        return terms